@@ -0,0 +1,107 @@
+"""
+Precomputed aggregates over the reference (data) and interested items tables.
+
+Postgres keeps them as materialized views, refreshed CONCURRENTLY (so Charts
+reads are never blocked) once writes have paused for a few seconds rather
+than inside each write. The local DuckDB copy keeps them as summary tables
+that are rebuilt the next time they are read after a write. Either way the
+charts tab only ever reads a handful of pre-grouped rows.
+The SQL below is written to run unchanged on both engines.
+"""
+
+# Helper: Parse a TEXT column such as 1'250'000 into a number (NULL if it isn't one)
+def numeric(column):
+    cleaned = f"REGEXP_REPLACE({column}, '['', ]', '', 'g')"
+    return f"CASE WHEN {cleaned} ~ '^[0-9]+(\\.[0-9]+)?$' THEN CAST({cleaned} AS DOUBLE PRECISION) END"
+
+
+LISTINGS = f"""
+    SELECT
+        "Canton",
+        "Gemeinde",
+        {numeric('"Buy Price"')} / NULLIF({numeric('"Living Space"')}, 0) AS price_per_sqm,
+        {numeric('traveltime')} AS traveltime,
+        {numeric('"MoreTaxPerMonth"')} AS more_tax_per_month
+    FROM {{maintained}}
+    WHERE status IS DISTINCT FROM 'delete'
+"""
+
+AGGREGATES = {
+    # Interested items per Canton
+    'agg_canton': f"""
+        SELECT
+            "Canton",
+            COUNT(*) AS listings,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY price_per_sqm) AS median_price_per_sqm,
+            AVG(traveltime) AS avg_traveltime,
+            AVG(more_tax_per_month) AS avg_more_tax_per_month
+        FROM ({LISTINGS}) listings
+        GROUP BY "Canton"
+    """,
+    # Interested items per Gemeinde (traveltime vs MoreTaxPerMonth)
+    'agg_gemeinde': f"""
+        SELECT
+            "Canton",
+            "Gemeinde",
+            COUNT(*) AS listings,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY price_per_sqm) AS median_price_per_sqm,
+            AVG(traveltime) AS avg_traveltime,
+            AVG(more_tax_per_month) AS avg_more_tax_per_month
+        FROM ({LISTINGS}) listings
+        GROUP BY "Canton", "Gemeinde"
+    """,
+    # Items added per month and status (including deleted ones)
+    'agg_status_month': """
+        SELECT
+            date_trunc('month', added_at) AS month,
+            status,
+            COUNT(*) AS listings
+        FROM {maintained}
+        GROUP BY date_trunc('month', added_at), status
+    """,
+    # Reference data per Canton
+    'agg_reference_canton': f"""
+        SELECT
+            "Canton",
+            COUNT(DISTINCT "Gemeinde") AS gemeinden,
+            AVG({numeric('"MoreTaxPerMonth"')}) AS avg_more_tax_per_month,
+            MIN({numeric('"MoreTaxPerMonth"')}) AS min_more_tax_per_month,
+            MAX({numeric('"MoreTaxPerMonth"')}) AS max_more_tax_per_month
+        FROM {{data}}
+        GROUP BY "Canton"
+    """,
+}
+
+
+# Group-by columns of each aggregate; REFRESH ... CONCURRENTLY needs a unique index on them
+AGGREGATE_KEYS = {
+    'agg_canton': ['Canton'],
+    'agg_gemeinde': ['Canton', 'Gemeinde'],
+    'agg_status_month': ['month', 'status'],
+    'agg_reference_canton': ['Canton'],
+}
+
+
+def aggregate_sql(name, data_table, maintained_table):
+    return AGGREGATES[name].format(data=data_table, maintained=maintained_table)
+
+
+def create_statements(engine, data_table, maintained_table):
+    """SQL that creates every aggregate ('postgres' or 'duckdb')."""
+    statements = []
+    for name in AGGREGATES:
+        sql = aggregate_sql(name, data_table, maintained_table)
+        if engine == 'postgres':
+            keys = ', '.join(f'"{key}"' for key in AGGREGATE_KEYS[name])
+            statements.append(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {sql}")
+            statements.append(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_key ON {name} ({keys})")
+        else:
+            statements.append(f"CREATE OR REPLACE TABLE {name} AS {sql}")
+    return statements
+
+
+def refresh_statements(engine, data_table, maintained_table):
+    """SQL that brings every aggregate up to date after a write."""
+    if engine == 'postgres':
+        return [f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}" for name in AGGREGATES]
+    return create_statements(engine, data_table, maintained_table)
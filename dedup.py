@@ -0,0 +1,110 @@
+"""
+Duplicate-listing detection for interested items.
+
+Two keys are stored on every row:
+- link_normalized: the listing URL with tracking parameters, mobile/www host
+  prefixes, fragments and trailing slashes removed (unique per table)
+- fingerprint: a hash of the Gemeinde and the scraped property fields, which
+  catches the same listing posted under a different URL
+"""
+
+import re
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+TRACKING_PARAMS = {
+    'gclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga',
+    'ref', 'referrer', 'source', 'src', 'campaign', 'share', 'shared',
+}
+TRACKING_PREFIXES = ('utm_',)
+HOST_PREFIXES = ('www.', 'm.', 'mobile.', 'amp.')
+DEFAULT_PORTS = {80, 443}
+FINGERPRINT_FIELDS = ['Buy Price', 'Rooms', 'Living Space', 'Land Area', 'Year Built']
+MERGE_FIELDS = FINGERPRINT_FIELDS
+
+
+# Helper: Treat None, '' and the strings pandas leaves behind as empty
+def is_blank(val):
+    if val is None:
+        return True
+    if isinstance(val, float) and (val != val):  # NaN check
+        return True
+    return str(val).strip() in ('', 'None', 'nan', 'NaN')
+
+
+def normalize_link(link):
+    """Canonical form of a listing URL, or None if there is no link."""
+    if is_blank(link):
+        return None
+    link = str(link).strip()
+    if '://' not in link:
+        link = 'https://' + link
+    parts = urlsplit(link)
+
+    host = (parts.hostname or '').lower()
+    stripped = True
+    while stripped:
+        stripped = False
+        for prefix in HOST_PREFIXES:
+            # Keep at least two labels: m.ch and mobile.de are sites, not prefixes
+            if host.startswith(prefix) and '.' in host[len(prefix):]:
+                host = host[len(prefix):]
+                stripped = True
+    if parts.port and parts.port not in DEFAULT_PORTS:
+        host = f'{host}:{parts.port}'
+
+    path = re.sub(r'/+', '/', parts.path).rstrip('/')
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    return urlunsplit(('https', host, path, urlencode(query), ''))
+
+
+# Helper: Normalize a scraped number such as 1'250'000 or "4.5" for hashing
+def normalize_number(val):
+    if is_blank(val):
+        return ''
+    cleaned = re.sub(r"['’, ]", '', str(val))
+    try:
+        return f'{float(cleaned):g}'
+    except ValueError:
+        return cleaned.lower()
+
+
+def content_fingerprint(row):
+    """Hash of Gemeinde + property fields; None unless price and living space are known."""
+    if is_blank(row.get('Buy Price')) or is_blank(row.get('Living Space')):
+        return None
+    gemeinde = '' if is_blank(row.get('Gemeinde')) else str(row.get('Gemeinde')).strip().lower()
+    key = '|'.join([gemeinde] + [normalize_number(row.get(field)) for field in FINGERPRINT_FIELDS])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def dedup_keys(row):
+    """The link_normalized and fingerprint columns for a row."""
+    return {
+        'link_normalized': normalize_link(row.get('link')),
+        'fingerprint': content_fingerprint(row),
+    }
+
+
+def merge_updates(existing, new_row):
+    """
+    Updates that fold a re-added listing into the existing row: fill property
+    fields the existing row is missing, append new notes, and revive the row
+    if it had been deleted.
+    """
+    updates = {}
+    for field in MERGE_FIELDS:
+        if is_blank(existing.get(field)) and not is_blank(new_row.get(field)):
+            updates[field] = str(new_row.get(field))
+    if is_blank(existing.get('link')) and not is_blank(new_row.get('link')):
+        updates['link'] = new_row.get('link')
+    new_notes = '' if is_blank(new_row.get('notes')) else str(new_row.get('notes')).strip()
+    old_notes = '' if is_blank(existing.get('notes')) else str(existing.get('notes')).strip()
+    if new_notes and new_notes not in old_notes:
+        updates['notes'] = f'{old_notes}\n{new_notes}'.strip()
+    if existing.get('status') == 'delete' and not is_blank(new_row.get('status')):
+        updates['status'] = new_row.get('status')
+    return updates
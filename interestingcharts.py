@@ -1,23 +1,23 @@
 import streamlit as st
 import pandas as pd
-import psycopg2
 import os
 from datetime import datetime
 import requests
 import re
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from storage import get_backend
+from ors_client import ORSClient
+from dedup import normalize_link, content_fingerprint, merge_updates
 
 # Load environment variables
 load_dotenv()
 
 # Constants
-TABLE_NAME = 'data'
-MAINTAINED_TABLE = 'interested_items1'
 STATIC_EXCEL_FILE = 'test.xlsx'  # Set this to your Excel file path, e.g., 'mydata.xlsx'
 ALLOWED_STATUSES = ['interested', 'contacted', 'reviewed', 'visited', 'confirmed', 'delete']
 ZURICH_HB_COORDS = (47.378177, 8.540192)  # Zurich HB lat, lon
-ORS_API_KEY = '5b3ce3597851110001cf62485d56c2c7ec274494b89bfae6e9b20178'  # Set your OpenRouteService API key as an environment variable
+ORS_API_KEY = os.getenv('ORS_API_KEY', '5b3ce3597851110001cf62485d56c2c7ec274494b89bfae6e9b20178')  # Set your OpenRouteService API key as an environment variable
 
 # Supabase Database Configuration
 SUPABASE_URL = "https://obwwflnrapkulpakklab.supabase.co"
@@ -43,265 +43,127 @@ The pooling URI typically uses port **6543**.
 
 # Helper: Clear add form fields
 def clear_add_fields():
+    # This runs before the button handler, so keep the submitted values for it
+    st.session_state['add_submitted'] = {
+        'link': st.session_state.get('add_link', ''),
+        'status': st.session_state.get('add_status', ALLOWED_STATUSES[0]),
+        'notes': st.session_state.get('add_notes', ''),
+    }
     st.session_state['add_link'] = ''
     st.session_state['add_status'] = ALLOWED_STATUSES[0]
     st.session_state['add_notes'] = ''
 
-# Helper: Connect to PostgreSQL
-def get_connection():
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        st.error(f"Database connection failed: {e}")
-        return None
+# Helper: Queue a message for the add form; it is shown on the next run, so it survives st.rerun()
+def flash(kind, message):
+    st.session_state.setdefault('add_messages', []).append((kind, message))
+
+# Helper: Show (and clear) the queued add form messages
+def show_flashed():
+    for kind, message in st.session_state.pop('add_messages', []):
+        getattr(st, kind)(message)
+
+# Helper: Get the storage backend (one per process, shared across sessions)
+@st.cache_resource
+def get_storage():
+    return get_backend(DATABASE_URL)
 
 # Helper: Initialize database tables
 def init_database():
-    conn = get_connection()
-    if conn is None:
-        return
-    
     try:
-        cursor = conn.cursor()
-        
-        # Create data table if it doesn't exist
-        cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-                id SERIAL PRIMARY KEY,
-                "Canton" TEXT,
-                "Gemeinde" TEXT,
-                "MoreTaxPerMonth" TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Create interested_items table if it doesn't exist
-        cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS {MAINTAINED_TABLE} (
-                id SERIAL PRIMARY KEY,
-                "Canton" TEXT,
-                "Gemeinde" TEXT,
-                "MoreTaxPerMonth" TEXT,
-                link TEXT,
-                notes TEXT,
-                status TEXT,
-                traveltime TEXT,
-                "Buy Price" TEXT,
-                "Rooms" TEXT,
-                "Living Space" TEXT,
-                "Land Area" TEXT,
-                "Year Built" TEXT,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
-        cursor.close()
+        get_storage().init()
     except Exception as e:
         st.error(f"Database initialization failed: {e}")
-    finally:
-        conn.close()
 
-# Helper: Load data from PostgreSQL
+# Helper: Load data from the storage backend
 def load_data():
-    conn = get_connection()
-    if conn is None:
-        return pd.DataFrame()
-    
     try:
-        df = pd.read_sql_query(f'SELECT * FROM {TABLE_NAME}', conn)
+        df = get_storage().load_data()
     except Exception as e:
         st.error(f"Error loading data: {e}")
         df = pd.DataFrame()
-    finally:
-        conn.close()
     return df
 
-# Helper: Save data to PostgreSQL
+# Helper: Save data to the storage backend
 def save_data(df):
-    conn = get_connection()
-    if conn is None:
-        return
-    
     try:
-        # Clear existing data and insert new data
-        cursor = conn.cursor()
-        cursor.execute(f'DELETE FROM {TABLE_NAME}')
-        
-        if not df.empty:
-            # Convert DataFrame to list of tuples for insertion
-            data_to_insert = []
-            for _, row in df.iterrows():
-                data_to_insert.append((
-                    row.get('Canton', ''),
-                    row.get('Gemeinde', ''),
-                    row.get('MoreTaxPerMonth', '')
-                ))
-            
-            cursor.executemany(
-                f'INSERT INTO {TABLE_NAME} ("Canton", "Gemeinde", "MoreTaxPerMonth") VALUES (%s, %s, %s)',
-                data_to_insert
-            )
-        
-        conn.commit()
-        cursor.close()
+        get_storage().save_data(df)
     except Exception as e:
         st.error(f"Error saving data: {e}")
-    finally:
-        conn.close()
 
 # Helper: Load maintained table
 def load_maintained():
-    conn = get_connection()
-    if conn is None:
-        return pd.DataFrame()
-    
     try:
-        df = pd.read_sql_query(f"SELECT * FROM {MAINTAINED_TABLE}", conn)
-        # Ensure all property columns are treated as strings to avoid dtype issues
-        property_columns = ["Buy Price", "MoreTaxPerMonth", "Rooms", "Living Space", "Land Area", "Year Built"]
-        for col in property_columns:
-            if col in df.columns:
-                df[col] = df[col].astype(str)
+        df = get_storage().load_maintained()
     except Exception as e:
         st.error(f"Error loading maintained data: {e}")
         df = pd.DataFrame()
-    finally:
-        conn.close()
     return df
 
 # Helper: Save maintained table
 def save_maintained(df):
-    conn = get_connection()
-    if conn is None:
-        return
-    
     try:
-        cursor = conn.cursor()
-        
-        # Clear existing data
-        cursor.execute(f"DELETE FROM {MAINTAINED_TABLE}")
-        
-        if not df.empty:
-            # Convert all property fields to strings to avoid dtype issues
-            df_copy = df.copy()
-            property_columns = ["Buy Price", "MoreTaxPerMonth", "Rooms", "Living Space", "Land Area", "Year Built"]
-            for col in property_columns:
-                if col in df_copy.columns:
-                    df_copy[col] = df_copy[col].astype(str)
-            
-            # Insert new data
-            for _, row in df_copy.iterrows():
-                cursor.execute(f"""
-                    INSERT INTO {MAINTAINED_TABLE} (
-                        "Canton", "Gemeinde", "MoreTaxPerMonth", link, notes, status, 
-                        traveltime, "Buy Price", "Rooms", "Living Space", "Land Area", "Year Built", added_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    row.get('Canton', ''),
-                    row.get('Gemeinde', ''),
-                    row.get('MoreTaxPerMonth', ''),
-                    row.get('link', ''),
-                    row.get('notes', ''),
-                    row.get('status', ''),
-                    row.get('traveltime'),
-                    row.get('Buy Price', ''),
-                    row.get('Rooms', ''),
-                    row.get('Living Space', ''),
-                    row.get('Land Area', ''),
-                    row.get('Year Built', ''),
-                    row.get('added_at', datetime.now().isoformat())
-                ))
-        
-        conn.commit()
-        cursor.close()
+        get_storage().save_maintained(df)
     except Exception as e:
         st.error(f"Error saving maintained data: {e}")
-    finally:
-        conn.close()
 
 # Helper: Update a single row in maintained table
 def update_maintained_row(row_id, updates):
-    conn = get_connection()
-    if conn is None:
-        return False
-    
     try:
-        cursor = conn.cursor()
-        
-        # Build dynamic UPDATE query
-        set_clauses = []
-        values = []
-        
-        for key, value in updates.items():
-            if key in ['link', 'notes', 'status', 'Buy Price', 'Rooms', 'Living Space', 'Land Area', 'Year Built']:
-                set_clauses.append(f'"{key}" = %s')
-                values.append(value)
-        
-        # Add updated_at timestamp
-        set_clauses.append('updated_at = CURRENT_TIMESTAMP')
-        
-        # Add row_id to values
-        values.append(row_id)
-        
-        query = f"UPDATE {MAINTAINED_TABLE} SET {', '.join(set_clauses)} WHERE id = %s"
-        cursor.execute(query, values)
-        
-        conn.commit()
-        cursor.close()
+        get_storage().update_maintained_row(row_id, updates)
         return True
     except Exception as e:
         st.error(f"Error updating row: {e}")
         return False
-    finally:
-        conn.close()
+
+# Helper: Find an interested item that the new listing duplicates
+def find_duplicate(link_normalized=None, fingerprint=None):
+    try:
+        return get_storage().find_duplicate(link_normalized=link_normalized, fingerprint=fingerprint)
+    except Exception as e:
+        st.error(f"Duplicate check failed: {e}")
+        return None
+
+# Helper: Load a precomputed aggregate (see analytics.py)
+def load_aggregate(name):
+    try:
+        df = get_storage().load_aggregate(name)
+    except Exception as e:
+        st.error(f"Error loading {name}: {e}")
+        df = pd.DataFrame()
+    return df
+
+# Helper: Get the ORS client (one per process, so rate limits and in-flight requests are shared)
+@st.cache_resource
+def get_ors_client():
+    return ORSClient(ORS_API_KEY)
 
 # Helper: Geocode Gemeinde to coordinates (using OpenRouteService geocode API)
 def geocode_location(place_name):
     if not ORS_API_KEY:
         return None
-    url = 'https://api.openrouteservice.org/geocode/search'
-    params = {
-        'api_key': ORS_API_KEY,
-        'text': f'{place_name}, Switzerland',
-        'boundary.country': 'CH',
-        'size': 1
-    }
     try:
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        features = resp.json().get('features', [])
-        if features:
-            coords = features[0]['geometry']['coordinates']  # [lon, lat]
-            return coords[1], coords[0]
-    except Exception:
+        return get_ors_client().geocode(place_name)
+    except Exception as e:
+        flash('warning', f"Geocoding {place_name} failed: {e}")
         return None
-    return None
 
 # Helper: Get driving time from Gemeinde to Zurich HB (using OpenRouteService directions API)
 def get_driving_time(from_coords, to_coords=ZURICH_HB_COORDS):
     if not ORS_API_KEY or not from_coords:
         return None
-    url = 'https://api.openrouteservice.org/v2/directions/driving-car'
-    headers = {'Authorization': ORS_API_KEY}
-    body = {
-        'coordinates': [
-            [from_coords[1], from_coords[0]],  # [lon, lat]
-            [to_coords[1], to_coords[0]]
-        ]
-    }
     try:
-        resp = requests.post(url, json=body, headers=headers, timeout=15)
-        resp.raise_for_status()
-        routes = resp.json().get('routes', [])
-        if routes:
-            seconds = routes[0]['summary']['duration']
-            return round(seconds / 60, 1)  # return in minutes
-    except Exception:
+        return get_ors_client().driving_time(from_coords, to_coords)
+    except Exception as e:
+        flash('warning', f"Driving time lookup failed: {e}")
         return None
-    return None
+
+# Helper: Travel time to Zurich HB for a new row; warns (after the rerun) if it could not be computed
+def lookup_traveltime(gemeinde_name):
+    coords = geocode_location(gemeinde_name)
+    travel_time_min = get_driving_time(coords) if coords else None
+    if travel_time_min is None:
+        flash('warning', f"No travel time for {gemeinde_name}; the item was saved without it.")
+    return travel_time_min
 
 def fetch_property_details(link):
     """Fetch Buy Price, Rooms, Living Space, Land Area, Year Built from the given link (if possible)."""
@@ -348,6 +210,24 @@ if 'db_initialized' not in st.session_state:
 st.title('Swiss House Search Helper')
 st.set_page_config(page_title='Swiss House Search Helper', layout='wide')
 
+# Show where reads/writes go and how many local writes still wait for sync
+storage_status = get_storage().status()
+if storage_status['backend'] != 'postgres':
+    st.sidebar.caption(f"Storage: {storage_status['backend']} · {storage_status['pending']} change(s) pending sync")
+    if storage_status['last_error']:
+        st.sidebar.warning(f"Last sync failed ({storage_status['attempts']} attempt(s)): {storage_status['last_error']}")
+    if storage_status['dead_letters']:
+        st.sidebar.error(f"{storage_status['dead_letters']} change(s) were rejected by the database and not synced")
+        with st.sidebar.expander('Rejected changes'):
+            st.dataframe(get_storage().dead_letters()[['op', 'payload', 'error']], hide_index=True)
+elif storage_status['last_error']:
+    # e.g. the chart aggregates could not be refreshed after a write
+    st.sidebar.warning(storage_status['last_error'])
+
+# OpenRouteService usage for this process
+with st.sidebar.expander('OpenRouteService usage'):
+    st.dataframe(pd.DataFrame(get_ors_client().stats()).T)
+
 # Load reference data from static Excel file
 if 'reference_data' not in st.session_state:
     try:
@@ -362,8 +242,8 @@ else:
 if ref_df.empty:
     st.warning('No reference data loaded. Please check the static Excel file.')
 else:
-    # Use tabs for Reference Table and Interested Items
-    tab1, tab2 = st.tabs(["Reference Table", "Interested Items"])
+    # Use tabs for Reference Table, Interested Items and Charts
+    tab1, tab2, tab3 = st.tabs(["Reference Table", "Interested Items", "Charts"])
 
     with tab1:
         st.subheader('Reference Table (from Excel)')
@@ -397,6 +277,7 @@ else:
 
         # Add to maintained table
         st.subheader('Add to Interested Items')
+        show_flashed()
         if not filtered_ref.empty:
             # If a row is selected, pre-fill the add form with its values
             if selected_ref_idx is not None:
@@ -427,9 +308,11 @@ else:
             notes = st.text_area('Notes', value=st.session_state['add_notes'], key='add_notes', height=100)
             st.write(f"Canton: {prefill_canton}")
             st.write(f"Gemeinde: {prefill_gemeinde}")
-            # Calculate time
-            travel_time_min = None
             if st.button('Add to Interested Items', key='add_btn', on_click=clear_add_fields):
+                submitted = st.session_state.pop('add_submitted', {})
+                link = submitted.get('link', link)
+                status = submitted.get('status', status)
+                notes = submitted.get('notes', notes)
                 # Insert directly into the database
                 row_data = ref_df.loc[row_idx, ['Canton', 'Gemeinde']] if all(col in ref_df.columns for col in ['Canton', 'Gemeinde']) else ref_df.loc[row_idx]
                 new_row = row_data.to_dict()
@@ -441,54 +324,58 @@ else:
                     new_row['MoreTaxPerMonth'] = None
                 new_row['status'] = status
                 new_row['added_at'] = datetime.now().isoformat()
-                gemeinde_name = new_row.get('Gemeinde', '')
-                coords = geocode_location(gemeinde_name)
-                if coords:
-                    travel_time_min = get_driving_time(coords)
-                    new_row['traveltime'] = travel_time_min
+                # Check for duplicates before any network work: the link first, then
+                # (after the page scrape) the content fingerprint, before geocoding/routing
+                duplicate = find_duplicate(link_normalized=normalize_link(link))
+                if duplicate is None:
+                    prop_details = fetch_property_details(link)
+                    for k, v in prop_details.items():
+                        new_row[k] = v
+                    duplicate = find_duplicate(fingerprint=content_fingerprint(new_row))
+                if duplicate is not None:
+                    st.session_state['pending_duplicate'] = {'existing': duplicate, 'new_row': new_row}
                 else:
-                    new_row['traveltime'] = None
-                prop_details = fetch_property_details(link)
-                for k, v in prop_details.items():
-                    new_row[k] = v
-                # Insert into DB
-                conn = get_connection()
-                try:
-                    cursor = conn.cursor()
-                    # Convert all values to string (TEXT columns)
-                    def safe_str(val):
-                        if val is None:
-                            return None
-                        if isinstance(val, float) and (val != val):  # NaN check
-                            return None
-                        return str(val)
-                    cursor.execute(f"""
-                        INSERT INTO {MAINTAINED_TABLE} (
-                            "Canton", "Gemeinde", "MoreTaxPerMonth", link, notes, status, traveltime, "Buy Price", "Rooms", "Living Space", "Land Area", "Year Built", added_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """, (
-                        safe_str(new_row.get('Canton', '')),
-                        safe_str(new_row.get('Gemeinde', '')),
-                        safe_str(new_row.get('MoreTaxPerMonth', '')),
-                        safe_str(new_row.get('link', '')),
-                        safe_str(new_row.get('notes', '')),
-                        safe_str(new_row.get('status', '')),
-                        safe_str(new_row.get('traveltime')),
-                        safe_str(new_row.get('Buy Price', '')),
-                        safe_str(new_row.get('Rooms', '')),
-                        safe_str(new_row.get('Living Space', '')),
-                        safe_str(new_row.get('Land Area', '')),
-                        safe_str(new_row.get('Year Built', '')),
-                        safe_str(new_row.get('added_at', datetime.now().isoformat()))
-                    ))
-                    conn.commit()
-                    cursor.close()
-                    st.success('Row added to interested items!')
+                    new_row['traveltime'] = lookup_traveltime(new_row.get('Gemeinde', ''))
+                    # Insert into DB
+                    try:
+                        get_storage().insert_maintained(new_row)
+                        flash('success', 'Row added to interested items!')
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Failed to add row: {e}")
+                        show_flashed()
+
+            # Offer to merge a re-added listing into the existing row
+            pending_duplicate = st.session_state.get('pending_duplicate')
+            if pending_duplicate:
+                existing = pending_duplicate['existing']
+                new_row = pending_duplicate['new_row']
+                same_link = normalize_link(new_row.get('link')) == existing.get('link_normalized')
+                st.warning(
+                    f"This listing is already in Interested Items: {existing.get('Canton')} - {existing.get('Gemeinde')} - {existing.get('link')} "
+                    f"(status: {existing.get('status')}, matched by {'link' if same_link else 'property details'})."
+                )
+                merge_col, add_col, cancel_col = st.columns(3)
+                if merge_col.button('Merge into existing', key='merge_duplicate_btn'):
+                    updates = merge_updates(existing, new_row)
+                    if not updates or update_maintained_row(int(existing['id']), updates):
+                        del st.session_state['pending_duplicate']
+                        flash('success', 'Merged into the existing item!')
+                        st.rerun()
+                # The unique link index rules out a second row with the same link
+                if not same_link and add_col.button('Add anyway', key='add_duplicate_btn'):
+                    new_row['traveltime'] = lookup_traveltime(new_row.get('Gemeinde', ''))
+                    try:
+                        get_storage().insert_maintained(new_row)
+                        del st.session_state['pending_duplicate']
+                        flash('success', 'Row added to interested items!')
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Failed to add row: {e}")
+                        show_flashed()
+                if cancel_col.button('Cancel', key='cancel_duplicate_btn'):
+                    del st.session_state['pending_duplicate']
                     st.rerun()
-                except Exception as e:
-                    st.error(f"Failed to add row: {e}")
-                finally:
-                    conn.close()
 
     with tab2:
         # Show maintained table with edit and filter options
@@ -558,8 +445,8 @@ else:
         # Start with desired columns that exist in the DataFrame
         ordered_cols = [col for col in desired_order if col in all_cols]
         
-        # Add all other columns that are not already in the list and are not 'id' or 'index'
-        remaining_cols = [col for col in all_cols if col not in ordered_cols and col not in ['id', 'index']]
+        # Add all other columns that are not already in the list and are not 'id', 'index' or dedup keys
+        remaining_cols = [col for col in all_cols if col not in ordered_cols and col not in ['id', 'index', 'link_normalized', 'fingerprint']]
         ordered_cols.extend(remaining_cols)
         
         df_display = filtered_maintained[ordered_cols].copy()
@@ -607,4 +494,30 @@ else:
         for col in ['Buy Price', 'Rooms', 'Living Space', 'Land Area', 'Year Built', 'notes']:
             if col not in ordered_cols and col in df_display.columns:
                 ordered_cols.append(col)
-        df_display = df_display.reindex(columns=ordered_cols) 
\ No newline at end of file
+        df_display = df_display.reindex(columns=ordered_cols)
+
+    with tab3:
+        # Charts render from the precomputed aggregates, never from the raw tables
+        st.subheader('Charts')
+        canton_agg = load_aggregate('agg_canton')
+        if canton_agg.empty:
+            st.info('No interested items to chart yet.')
+        else:
+            st.write('Median price per m² by Canton')
+            st.bar_chart(canton_agg.set_index('Canton')['median_price_per_sqm'])
+            st.dataframe(canton_agg, hide_index=True)
+
+        status_agg = load_aggregate('agg_status_month')
+        if not status_agg.empty:
+            st.write('Items added per month by status')
+            st.bar_chart(status_agg.pivot_table(index='month', columns='status', values='listings', aggfunc='sum', fill_value=0))
+
+        gemeinde_agg = load_aggregate('agg_gemeinde')
+        if not gemeinde_agg.empty:
+            st.write('Average travel time to Zurich HB vs MoreTaxPerMonth by Gemeinde')
+            st.scatter_chart(gemeinde_agg, x='avg_more_tax_per_month', y='avg_traveltime', color='Canton')
+
+        reference_agg = load_aggregate('agg_reference_canton')
+        if not reference_agg.empty:
+            st.write('Reference data by Canton')
+            st.dataframe(reference_agg, hide_index=True)
@@ -0,0 +1,235 @@
+"""
+OpenRouteService client shared by every session of the app.
+
+- token bucket per endpoint so bursts stay under the per-minute limits
+- single-flight: identical requests already in flight are joined, not repeated
+- retries with exponential backoff on 429 / 5xx / connection errors
+- daily quota tracking per endpoint
+- call counts and latencies for display
+"""
+
+import json
+import random
+import threading
+import time
+from datetime import date
+
+import requests
+
+ORS_BASE_URL = 'https://api.openrouteservice.org'
+
+# Free-tier limits: (requests per minute, requests per day)
+ENDPOINT_LIMITS = {
+    'geocode': (100, 1000),
+    'directions': (40, 2000),
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_REQUEST_SECONDS = 15  # longest per-request timeout used in send()
+
+
+class QuotaExceeded(Exception):
+    """The daily request quota for an endpoint has been used up."""
+
+
+class TokenBucket:
+    """Allow `rate` requests per `per` seconds, with bursts of up to `rate`."""
+
+    def __init__(self, rate, per=60.0):
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting for one if needed. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.fill_rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class _Flight:
+    """A request in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ORSClient:
+    def __init__(self, api_key, max_retries=3, backoff=1.0, wait_timeout=30.0, session=None):
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.wait_timeout = wait_timeout  # max seconds one call spends waiting on rate limits and backoff
+        # A joined caller waits at most as long as the leader can take
+        self.flight_timeout = wait_timeout + MAX_REQUEST_SECONDS * (max_retries + 1)
+        self.session = session or requests.Session()
+        self.buckets = {name: TokenBucket(per_minute) for name, (per_minute, _) in ENDPOINT_LIMITS.items()}
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.quota_day = date.today()
+        self.used_today = {name: 0 for name in ENDPOINT_LIMITS}
+        self.remaining = {}  # last x-ratelimit-remaining reported by ORS
+        self.counters = {
+            name: {'calls': 0, 'errors': 0, 'retries': 0, 'coalesced': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            for name in ENDPOINT_LIMITS
+        }
+
+    # Public API
+
+    def geocode(self, place_name):
+        """Return (lat, lon) for a Swiss place name, or None."""
+        params = {
+            'text': f'{place_name}, Switzerland',
+            'boundary.country': 'CH',
+            'size': 1
+        }
+        data = self.request('geocode', 'GET', '/geocode/search', params=params)
+        features = data.get('features', [])
+        if features:
+            coords = features[0]['geometry']['coordinates']  # [lon, lat]
+            return coords[1], coords[0]
+        return None
+
+    def driving_time(self, from_coords, to_coords):
+        """Return the driving time between two (lat, lon) points in minutes, or None."""
+        body = {
+            'coordinates': [
+                [from_coords[1], from_coords[0]],  # [lon, lat]
+                [to_coords[1], to_coords[0]]
+            ]
+        }
+        data = self.request('directions', 'POST', '/v2/directions/driving-car', body=body)
+        routes = data.get('routes', [])
+        if routes:
+            seconds = routes[0]['summary']['duration']
+            return round(seconds / 60, 1)  # return in minutes
+        return None
+
+    def stats(self):
+        """Call counts, latencies and quota usage per endpoint."""
+        self.roll_quota_day()
+        with self.lock:
+            result = {}
+            for name, counter in self.counters.items():
+                result[name] = {
+                    'calls': counter['calls'],
+                    'errors': counter['errors'],
+                    'retries': counter['retries'],
+                    'coalesced': counter['coalesced'],
+                    'avg_ms': round(counter['total_ms'] / counter['calls'], 1) if counter['calls'] else None,
+                    'max_ms': round(counter['max_ms'], 1),
+                    'used_today': self.used_today[name],
+                    'daily_quota': ENDPOINT_LIMITS[name][1],
+                    'remaining': self.remaining.get(name),
+                }
+            return result
+
+    # Internals
+
+    def request(self, endpoint, method, path, params=None, body=None):
+        """Run a request, joining an identical one that is already in flight."""
+        key = (endpoint, method, path, json.dumps(params, sort_keys=True), json.dumps(body, sort_keys=True))
+        with self.lock:
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self.in_flight[key] = flight
+            else:
+                self.counters[endpoint]['coalesced'] += 1
+
+        if not leader:
+            if not flight.done.wait(self.flight_timeout):
+                raise TimeoutError(f"Identical {endpoint} request still running after {self.flight_timeout}s")
+        else:
+            try:
+                flight.result = self.send(endpoint, method, path, params, body)
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+                flight.done.set()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def send(self, endpoint, method, path, params, body):
+        # This runs on the Streamlit script thread; all waiting shares one budget
+        deadline = time.monotonic() + self.wait_timeout
+        attempt = 0
+        while True:
+            self.take_quota(endpoint)
+            if not self.buckets[endpoint].acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise TimeoutError(f"Rate limit wait for {endpoint} exceeded {self.wait_timeout}s")
+
+            started = time.monotonic()
+            retry_after = None
+            try:
+                if method == 'GET':
+                    resp = self.session.get(ORS_BASE_URL + path, params=dict(params, api_key=self.api_key), timeout=10)
+                else:
+                    resp = self.session.post(ORS_BASE_URL + path, json=body, headers={'Authorization': self.api_key}, timeout=MAX_REQUEST_SECONDS)
+                self.record(endpoint, started, resp)
+                if resp.status_code not in RETRY_STATUSES:
+                    resp.raise_for_status()
+                    return resp.json()
+                retry_after = resp.headers.get('Retry-After')
+                error = requests.HTTPError(f"{resp.status_code} from ORS {endpoint}", response=resp)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record(endpoint, started, None)
+                error = e
+
+            if attempt >= self.max_retries:
+                raise error
+            attempt += 1
+            with self.lock:
+                self.counters[endpoint]['retries'] += 1
+            delay = self.backoff * 2 ** (attempt - 1) + random.uniform(0, self.backoff)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            if time.monotonic() + delay > deadline:
+                # e.g. a 429 with a Retry-After of hours once the ORS quota is used up
+                raise error
+            time.sleep(delay)
+
+    def roll_quota_day(self):
+        with self.lock:
+            if self.quota_day != date.today():
+                self.quota_day = date.today()
+                self.used_today = {name: 0 for name in ENDPOINT_LIMITS}
+                self.remaining = {}
+
+    def take_quota(self, endpoint):
+        self.roll_quota_day()
+        with self.lock:
+            if self.used_today[endpoint] >= ENDPOINT_LIMITS[endpoint][1] or self.remaining.get(endpoint) == 0:
+                raise QuotaExceeded(f"Daily ORS quota for {endpoint} used up")
+            self.used_today[endpoint] += 1
+
+    def record(self, endpoint, started, resp):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self.lock:
+            counter = self.counters[endpoint]
+            counter['calls'] += 1
+            counter['total_ms'] += elapsed_ms
+            counter['max_ms'] = max(counter['max_ms'], elapsed_ms)
+            if resp is None or resp.status_code >= 400:
+                counter['errors'] += 1
+            if resp is not None and resp.headers.get('x-ratelimit-remaining', '').isdigit():
+                self.remaining[endpoint] = int(resp.headers['x-ratelimit-remaining'])
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Snapshot export/import for the Supabase tables
+Streams tables to partitioned Parquet files and restores them with COPY
+
+    python snapshot.py export snapshots/2024-06-01
+    python snapshot.py import snapshots/2024-06-01
+"""
+
+import os
+import io
+import sys
+import json
+import argparse
+from datetime import datetime
+
+import psycopg2
+from psycopg2 import sql
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from storage import TABLE_NAME, MAINTAINED_TABLE, PostgresBackend
+
+SNAPSHOT_TABLES = [MAINTAINED_TABLE, TABLE_NAME]
+CHUNK_ROWS = 50_000
+MANIFEST_FILE = 'manifest.json'
+
+# Postgres data_type -> Arrow type (anything else is exported as text)
+ARROW_TYPES = {
+    'text': pa.string(),
+    'character varying': pa.string(),
+    'smallint': pa.int16(),
+    'integer': pa.int32(),
+    'bigint': pa.int64(),
+    'real': pa.float32(),
+    'double precision': pa.float64(),
+    'boolean': pa.bool_(),
+    'date': pa.date32(),
+    'timestamp without time zone': pa.timestamp('us'),
+    'timestamp with time zone': pa.timestamp('us', tz='UTC'),
+}
+
+
+def list_tables(cursor):
+    """The app tables plus any *_history tables that exist."""
+    cursor.execute("""
+        SELECT table_name FROM information_schema.tables
+        WHERE table_schema = 'public' AND table_type = 'BASE TABLE' AND table_name LIKE %s
+        ORDER BY table_name
+    """, ('%\\_history',))
+    return SNAPSHOT_TABLES + [row[0] for row in cursor.fetchall() if row[0] not in SNAPSHOT_TABLES]
+
+
+def table_columns(cursor, table):
+    cursor.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s
+        ORDER BY ordinal_position
+    """, (table,))
+    return cursor.fetchall()
+
+
+def export_table(conn, table, out_dir, chunk_rows=CHUNK_ROWS):
+    """Stream one table into out_dir/<table>/part-NNNNN.parquet; returns its manifest entry."""
+    cursor = conn.cursor()
+    columns = table_columns(cursor, table)
+    cursor.close()
+    if not columns:
+        return None
+
+    schema = pa.schema([(name, ARROW_TYPES.get(data_type, pa.string())) for name, data_type in columns])
+    select_list = sql.SQL(', ').join(
+        sql.Identifier(name) if data_type in ARROW_TYPES else sql.SQL('{}::text').format(sql.Identifier(name))
+        for name, data_type in columns
+    )
+
+    table_dir = os.path.join(out_dir, table)
+    os.makedirs(table_dir, exist_ok=True)
+
+    # Named cursor = server-side cursor, so only one chunk is held in memory at a time
+    cursor = conn.cursor(name=f'snapshot_{table}')
+    cursor.itersize = chunk_rows
+    cursor.execute(sql.SQL('SELECT {} FROM {}').format(select_list, sql.Identifier(table)))
+    rows_written = 0
+    part = 0
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows and part > 0:
+            break
+        arrays = [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)]
+        pq.write_table(
+            pa.Table.from_arrays(arrays, schema=schema),
+            os.path.join(table_dir, f'part-{part:05d}.parquet'),
+            compression='zstd'
+        )
+        rows_written += len(rows)
+        part += 1
+        if len(rows) < chunk_rows:
+            break
+    cursor.close()
+
+    return {
+        'columns': [{'name': name, 'type': data_type} for name, data_type in columns],
+        'rows': rows_written,
+        'parts': part,
+    }
+
+
+def export_snapshot(database_url, out_dir, tables=None, chunk_rows=CHUNK_ROWS):
+    """Export tables (default: app tables + *_history) to out_dir"""
+    try:
+        conn = psycopg2.connect(database_url)
+        conn.set_session(readonly=True, isolation_level='REPEATABLE READ')  # one consistent view of all tables
+        cursor = conn.cursor()
+        tables = tables or list_tables(cursor)
+        cursor.close()
+
+        os.makedirs(out_dir, exist_ok=True)
+        manifest = {'created_at': datetime.now().isoformat(), 'tables': {}}
+        for table in tables:
+            entry = export_table(conn, table, out_dir, chunk_rows)
+            if entry is None:
+                print(f"ℹ️ Table {table} not found, skipping")
+                continue
+            manifest['tables'][table] = entry
+            print(f"📦 Exported {entry['rows']} rows from {table} in {entry['parts']} part(s)")
+        conn.close()
+
+        with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        print(f"🎉 Snapshot written to {out_dir}")
+        return True
+    except Exception as e:
+        print(f"❌ Export failed: {e}")
+        return False
+
+
+def import_table(cursor, table, entry, in_dir, batch_rows=CHUNK_ROWS):
+    """COPY every part file of one table, one record batch at a time."""
+    columns = [column['name'] for column in entry['columns']]
+    cursor.execute(sql.SQL('CREATE TABLE IF NOT EXISTS {} ({})').format(
+        sql.Identifier(table),
+        sql.SQL(', ').join(
+            sql.SQL('{} {}').format(
+                sql.Identifier(column['name']),
+                sql.SQL(column['type'] if column['type'] in ARROW_TYPES else 'text')
+            )
+            for column in entry['columns']
+        )
+    ))
+    cursor.execute(sql.SQL('TRUNCATE {}').format(sql.Identifier(table)))
+    copy = sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv, HEADER true)').format(
+        sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns))
+    )
+
+    rows = 0
+    table_dir = os.path.join(in_dir, table)
+    for part in sorted(os.listdir(table_dir)):
+        parquet_file = pq.ParquetFile(os.path.join(table_dir, part))
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns):
+            buffer = io.BytesIO()
+            pa_csv.write_csv(batch, buffer)
+            buffer.seek(0)
+            cursor.copy_expert(copy, buffer)
+            rows += batch.num_rows
+
+    # Keep SERIAL ids ahead of the restored rows
+    if 'id' in columns:
+        cursor.execute(
+            sql.SQL("SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {}")
+            .format(sql.Identifier(table)),
+            (table,)
+        )
+    return rows
+
+
+def import_snapshot(database_url, in_dir):
+    """Replace the contents of every table in the snapshot (single transaction)"""
+    manifest_path = os.path.join(in_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        print(f"❌ {manifest_path} not found")
+        return False
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        backend = PostgresBackend(database_url)
+        backend.init()
+        conn = psycopg2.connect(database_url)
+        cursor = conn.cursor()
+        for table, entry in manifest['tables'].items():
+            rows = import_table(cursor, table, entry, in_dir)
+            print(f"🔄 Restored {rows} rows into {table}")
+        conn.commit()
+        cursor.close()
+        conn.close()
+        backend.refresh_aggregates()
+        if backend.last_error:
+            print(f"⚠️ {backend.last_error}")
+        print("🎉 Import completed successfully!")
+        return True
+    except Exception as e:
+        print(f"❌ Import failed: {e}")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export or import a Parquet snapshot of the database')
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('directory')
+    parser.add_argument('--table', action='append', help='Only export this table (repeatable)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        print("❌ DATABASE_URL environment variable not set")
+        sys.exit(1)
+
+    if args.command == 'export':
+        ok = export_snapshot(database_url, args.directory, args.table, args.chunk_rows)
+    else:
+        ok = import_snapshot(database_url, args.directory)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
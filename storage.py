@@ -0,0 +1,909 @@
+"""
+Storage backends for the Swiss House Search Helper.
+
+PostgresBackend talks to Supabase directly (the original behaviour).
+DuckDBBackend keeps an embedded copy of the tables for reads and records every
+write in a local outbox table which a background thread replays against Postgres.
+"""
+
+import os
+import json
+import threading
+import time
+from datetime import datetime
+
+import duckdb
+import pandas as pd
+import psycopg2
+
+from analytics import AGGREGATES, create_statements, refresh_statements
+from dedup import FINGERPRINT_FIELDS, dedup_keys, normalize_link, merge_updates
+
+# Constants
+TABLE_NAME = 'data'
+MAINTAINED_TABLE = 'interested_items1'
+OUTBOX_TABLE = 'sync_outbox'
+ID_MAP_TABLE = 'sync_id_map'
+DEAD_LETTER_TABLE = 'sync_dead_letter'
+# Replay errors that retrying will not fix; the entry is set aside so later writes keep syncing
+PERMANENT_SYNC_ERRORS = (psycopg2.IntegrityError, psycopg2.DataError, psycopg2.ProgrammingError, ValueError)
+DUCKDB_FILE = 'local_cache.duckdb'  # git-ignored; interestingcharts.duckdb is the legacy migration source
+PROPERTY_COLUMNS = ["Buy Price", "MoreTaxPerMonth", "Rooms", "Living Space", "Land Area", "Year Built"]
+DATA_COLUMNS = ["Canton", "Gemeinde", "MoreTaxPerMonth"]
+MAINTAINED_COLUMNS = [
+    "Canton", "Gemeinde", "MoreTaxPerMonth", "link", "notes", "status",
+    "traveltime", "Buy Price", "Rooms", "Living Space", "Land Area", "Year Built", "added_at",
+    "link_normalized", "fingerprint"
+]
+DEDUP_SOURCE_COLUMNS = ["link", "Gemeinde"] + FINGERPRINT_FIELDS
+EDITABLE_COLUMNS = ['link', 'notes', 'status', 'Buy Price', 'Rooms', 'Living Space', 'Land Area', 'Year Built']
+
+
+# Helper: Convert a value for a TEXT column (None and NaN become NULL)
+def safe_str(val):
+    if val is None:
+        return None
+    if isinstance(val, float) and (val != val):  # NaN check
+        return None
+    return str(val)
+
+
+# Helper: Quote column names for SQL (several contain spaces)
+def quote_columns(columns):
+    return ', '.join(f'"{col}"' for col in columns)
+
+
+# Helper: Extract values for an INSERT from a row dict / Series
+def row_values(row, columns):
+    values = []
+    for col in columns:
+        if col == 'added_at':
+            values.append(safe_str(row.get('added_at')) or datetime.now().isoformat())
+        else:
+            values.append(safe_str(row.get(col)))
+    return values
+
+
+# Helper: Values for an interested items INSERT, with the dedup keys filled in
+def maintained_values(row):
+    row = dict(row)
+    row.update(dedup_keys(row))
+    return row_values(row, MAINTAINED_COLUMNS)
+
+
+# Helper: Drop rows whose normalized link already appeared earlier in the list
+def drop_duplicate_links(rows):
+    seen = set()
+    unique_rows = []
+    for row in rows:
+        if row['link_normalized'] is not None:
+            if row['link_normalized'] in seen:
+                continue
+            seen.add(row['link_normalized'])
+        unique_rows.append(row)
+    return unique_rows
+
+
+def backfill_dedup_keys(rows, taken):
+    """
+    (link_normalized, fingerprint, id) for rows saved before the dedup columns
+    existed. A link that normalizes to one already in use is left NULL so the
+    unique index can still be built; such rows need merging by hand.
+    """
+    result = []
+    for row_id, *values in rows:
+        keys = dedup_keys(dict(zip(DEDUP_SOURCE_COLUMNS, values)))
+        if keys['link_normalized'] in taken:
+            keys['link_normalized'] = None
+        elif keys['link_normalized'] is not None:
+            taken.add(keys['link_normalized'])
+        if keys['link_normalized'] is not None or keys['fingerprint'] is not None:
+            result.append((keys['link_normalized'], keys['fingerprint'], row_id))
+    return result
+
+
+def changed_dedup_keys(current, updates):
+    """
+    The dedup keys an update changes. A key whose source columns are not being
+    edited keeps its stored value, which may be a NULL left by the backfill.
+    """
+    keys = dedup_keys({**current, **updates})
+    if 'link' not in updates:
+        del keys['link_normalized']
+    if not any(field in updates for field in FINGERPRINT_FIELDS):
+        del keys['fingerprint']
+    return keys
+
+
+# Helper: First row of a DataFrame as a dict (None if empty)
+def first_row(df):
+    return None if df.empty else df.iloc[0].to_dict()
+
+
+# Helper: Treat property columns as strings to avoid dtype issues
+def normalize_maintained(df):
+    for col in PROPERTY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(str)
+    return df
+
+
+def check_aggregate(name):
+    if name not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate: {name}")
+
+
+def filter_updates(updates):
+    """Keep only the columns a user is allowed to edit."""
+    return {key: value for key, value in updates.items() if key in EDITABLE_COLUMNS}
+
+
+class PostgresBackend:
+    """Every read and write goes straight to the Supabase Postgres database."""
+
+    def __init__(self, database_url, refresh_delay=5.0, refresh_max_delay=30.0):
+        self.database_url = database_url
+        self.refresh_delay = refresh_delay
+        self.refresh_max_delay = refresh_max_delay
+        self.refresh_timer = None
+        self.refresh_due = None
+        self.refresh_lock = threading.Lock()
+        self.last_error = None
+
+    def connect(self):
+        return psycopg2.connect(self.database_url)
+
+    def init(self):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+
+            # Create data table if it doesn't exist
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    id SERIAL PRIMARY KEY,
+                    "Canton" TEXT,
+                    "Gemeinde" TEXT,
+                    "MoreTaxPerMonth" TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Create interested_items table if it doesn't exist
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {MAINTAINED_TABLE} (
+                    id SERIAL PRIMARY KEY,
+                    "Canton" TEXT,
+                    "Gemeinde" TEXT,
+                    "MoreTaxPerMonth" TEXT,
+                    link TEXT,
+                    notes TEXT,
+                    status TEXT,
+                    traveltime TEXT,
+                    "Buy Price" TEXT,
+                    "Rooms" TEXT,
+                    "Living Space" TEXT,
+                    "Land Area" TEXT,
+                    "Year Built" TEXT,
+                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Duplicate detection keys (see dedup.py)
+            cursor.execute(f'ALTER TABLE {MAINTAINED_TABLE} ADD COLUMN IF NOT EXISTS link_normalized TEXT')
+            cursor.execute(f'ALTER TABLE {MAINTAINED_TABLE} ADD COLUMN IF NOT EXISTS fingerprint TEXT')
+            cursor.execute(f'SELECT link_normalized FROM {MAINTAINED_TABLE} WHERE link_normalized IS NOT NULL')
+            taken = {row[0] for row in cursor.fetchall()}
+            cursor.execute(
+                f'SELECT id, {quote_columns(DEDUP_SOURCE_COLUMNS)} FROM {MAINTAINED_TABLE} '
+                'WHERE link_normalized IS NULL AND fingerprint IS NULL ORDER BY id'
+            )
+            cursor.executemany(
+                f'UPDATE {MAINTAINED_TABLE} SET link_normalized = %s, fingerprint = %s WHERE id = %s',
+                backfill_dedup_keys(cursor.fetchall(), taken)
+            )
+            cursor.execute(
+                f'CREATE UNIQUE INDEX IF NOT EXISTS {MAINTAINED_TABLE}_link_normalized_key '
+                f'ON {MAINTAINED_TABLE} (link_normalized)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {MAINTAINED_TABLE}_fingerprint_idx ON {MAINTAINED_TABLE} (fingerprint)'
+            )
+
+            # Create the aggregates behind the charts tab
+            for statement in create_statements('postgres', TABLE_NAME, MAINTAINED_TABLE):
+                cursor.execute(statement)
+
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def load_data(self):
+        conn = self.connect()
+        try:
+            return pd.read_sql_query(f'SELECT * FROM {TABLE_NAME}', conn)
+        finally:
+            conn.close()
+
+    def save_data(self, df):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            pg_replace_data(cursor, df)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        self.schedule_aggregate_refresh()
+
+    def load_maintained(self):
+        conn = self.connect()
+        try:
+            return normalize_maintained(pg_load_maintained(conn))
+        finally:
+            conn.close()
+
+    def save_maintained(self, df):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"DELETE FROM {MAINTAINED_TABLE}")
+            rows = [dict(zip(MAINTAINED_COLUMNS, maintained_values(row))) for _, row in df.iterrows()]
+            for row in drop_duplicate_links(rows):
+                pg_insert_maintained(cursor, row)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        self.schedule_aggregate_refresh()
+
+    def insert_maintained(self, row):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            row_id = pg_insert_maintained(cursor, row)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        self.schedule_aggregate_refresh()
+        return row_id
+
+    def update_maintained_row(self, row_id, updates):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            pg_update_maintained(cursor, row_id, updates)
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        self.schedule_aggregate_refresh()
+
+    def find_duplicate(self, link_normalized=None, fingerprint=None, exclude_id=None):
+        """The existing interested item with this normalized link or fingerprint, if any."""
+        conn = self.connect()
+        try:
+            for column, value in [('link_normalized', link_normalized), ('fingerprint', fingerprint)]:
+                if value is not None:
+                    row = first_row(pd.read_sql_query(
+                        f"SELECT * FROM {MAINTAINED_TABLE} WHERE {column} = %s AND id IS DISTINCT FROM %s ORDER BY id LIMIT 1",
+                        conn, params=[value, exclude_id]
+                    ))
+                    if row is not None:
+                        return row
+            return None
+        finally:
+            conn.close()
+
+    def load_aggregate(self, name):
+        check_aggregate(name)
+        conn = self.connect()
+        try:
+            return pd.read_sql_query(f"SELECT * FROM {name}", conn)
+        finally:
+            conn.close()
+
+    def schedule_aggregate_refresh(self):
+        """
+        Refresh the materialized views once writes have paused for refresh_delay
+        seconds, so a burst of writes shares one refresh. A steady stream of
+        writes still gets one every refresh_max_delay seconds.
+        """
+        with self.refresh_lock:
+            now = time.monotonic()
+            if self.refresh_timer is None:
+                self.refresh_due = now + self.refresh_max_delay
+            else:
+                self.refresh_timer.cancel()
+            delay = max(0.0, min(self.refresh_delay, self.refresh_due - now))
+            self.refresh_timer = threading.Timer(delay, self.refresh_aggregates)
+            self.refresh_timer.daemon = True
+            self.refresh_timer.start()
+
+    def refresh_aggregates(self):
+        """REFRESH ... CONCURRENTLY every materialized view, outside any write transaction."""
+        with self.refresh_lock:
+            if self.refresh_timer is threading.current_thread():
+                self.refresh_timer = None
+        try:
+            conn = self.connect()
+            try:
+                conn.autocommit = True
+                cursor = conn.cursor()
+                pg_refresh_aggregates(cursor)
+                cursor.close()
+            finally:
+                conn.close()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"Refreshing charts failed: {e}"
+
+    def status(self):
+        return {'backend': 'postgres', 'pending': 0, 'attempts': 0, 'dead_letters': 0, 'last_sync': None, 'last_error': self.last_error}
+
+
+# Helper: Refresh the materialized views (Postgres cursor, outside any write transaction)
+def pg_refresh_aggregates(cursor):
+    for statement in refresh_statements('postgres', TABLE_NAME, MAINTAINED_TABLE):
+        cursor.execute(statement)
+
+
+# Helper: The interested items table as stored, NULLs included (Postgres connection)
+def pg_load_maintained(conn):
+    return pd.read_sql_query(f"SELECT * FROM {MAINTAINED_TABLE}", conn)
+
+
+# Helper: Replace the contents of the data table (Postgres cursor)
+def pg_replace_data(cursor, df):
+    cursor.execute(f'DELETE FROM {TABLE_NAME}')
+    if not df.empty:
+        cursor.executemany(
+            f'INSERT INTO {TABLE_NAME} ({quote_columns(DATA_COLUMNS)}) VALUES (%s, %s, %s)',
+            [row_values(row, DATA_COLUMNS) for _, row in df.iterrows()]
+        )
+
+
+# Helper: Insert one interested item and return its new id (Postgres cursor)
+def pg_insert_maintained(cursor, row):
+    placeholders = ', '.join(['%s'] * len(MAINTAINED_COLUMNS))
+    cursor.execute(
+        f'INSERT INTO {MAINTAINED_TABLE} ({quote_columns(MAINTAINED_COLUMNS)}) VALUES ({placeholders}) RETURNING id',
+        maintained_values(row)
+    )
+    return cursor.fetchone()[0]
+
+
+# Helper: Fold a row into the existing one with the same link and return that id (Postgres cursor)
+def pg_merge_maintained(cursor, row):
+    cursor.execute(
+        f'SELECT * FROM {MAINTAINED_TABLE} WHERE link_normalized = %s', [normalize_link(row.get('link'))]
+    )
+    existing = dict(zip([column[0] for column in cursor.description], cursor.fetchone()))
+    updates = merge_updates(existing, row)
+    if updates:
+        pg_update_maintained(cursor, existing['id'], updates)
+    return existing['id']
+
+
+# Helper: Update a single interested item (Postgres cursor)
+def pg_update_maintained(cursor, row_id, updates):
+    updates = filter_updates(updates)
+    cursor.execute(f'SELECT {quote_columns(DEDUP_SOURCE_COLUMNS)} FROM {MAINTAINED_TABLE} WHERE id = %s', [row_id])
+    current = cursor.fetchone()
+    if current is not None:
+        updates.update(changed_dedup_keys(dict(zip(DEDUP_SOURCE_COLUMNS, current)), updates))
+    set_clauses = [f'"{key}" = %s' for key in updates]
+    set_clauses.append('updated_at = CURRENT_TIMESTAMP')
+    cursor.execute(
+        f"UPDATE {MAINTAINED_TABLE} SET {', '.join(set_clauses)} WHERE id = %s",
+        list(updates.values()) + [row_id]
+    )
+    if cursor.rowcount == 0:
+        raise ValueError(f"Interested item {row_id} no longer exists")
+
+
+class DuckDBBackend:
+    """
+    Local-first storage: reads and writes hit an embedded DuckDB file, and each
+    write is appended to an outbox in the same transaction. When a database URL
+    is given, a background thread replays the outbox against Postgres and pulls
+    a fresh copy of the remote tables once the outbox is empty.
+
+    Rows created locally get negative ids until they have been synced; the
+    replay then swaps in the id Postgres assigned, including in any outbox
+    entries still pending for that row. The swap is recorded in an id map so
+    a page that still holds the old negative id edits the right row.
+
+    The sync thread first runs PostgresBackend.init() against the remote, so
+    the schema exists before the first replay. Connection problems are retried
+    with backoff. An entry that Postgres
+    rejects outright (constraint violation, row gone) is moved to a dead-letter
+    table with the error, so it cannot hold up the rest of the outbox.
+    """
+
+    def __init__(self, path=DUCKDB_FILE, sync_url=None, sync_interval=2.0, refresh_interval=60.0):
+        self.path = path
+        self.remote = PostgresBackend(sync_url) if sync_url else None
+        self.sync_interval = sync_interval
+        self.refresh_interval = refresh_interval
+        self.conn = duckdb.connect(path)
+        self.lock = threading.RLock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.version = 0  # bumped on every local write
+        self.last_sync = None
+        self.last_refresh = 0.0
+        self.last_error = None
+        self.aggregates_stale = False  # set by writes; summary tables are rebuilt on the next read
+
+    def init(self):
+        with self.lock:
+            self.conn.execute("CREATE SEQUENCE IF NOT EXISTS local_id_seq")
+            self.conn.execute("CREATE SEQUENCE IF NOT EXISTS outbox_id_seq")
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    id BIGINT,
+                    "Canton" VARCHAR,
+                    "Gemeinde" VARCHAR,
+                    "MoreTaxPerMonth" VARCHAR,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {MAINTAINED_TABLE} (
+                    id BIGINT,
+                    "Canton" VARCHAR,
+                    "Gemeinde" VARCHAR,
+                    "MoreTaxPerMonth" VARCHAR,
+                    link VARCHAR,
+                    notes VARCHAR,
+                    status VARCHAR,
+                    traveltime VARCHAR,
+                    "Buy Price" VARCHAR,
+                    "Rooms" VARCHAR,
+                    "Living Space" VARCHAR,
+                    "Land Area" VARCHAR,
+                    "Year Built" VARCHAR,
+                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self.conn.execute(f'ALTER TABLE {MAINTAINED_TABLE} ADD COLUMN IF NOT EXISTS link_normalized VARCHAR')
+            self.conn.execute(f'ALTER TABLE {MAINTAINED_TABLE} ADD COLUMN IF NOT EXISTS fingerprint VARCHAR')
+            taken = {row[0] for row in self.conn.execute(
+                f'SELECT link_normalized FROM {MAINTAINED_TABLE} WHERE link_normalized IS NOT NULL'
+            ).fetchall()}
+            pending = self.conn.execute(
+                f'SELECT id, {quote_columns(DEDUP_SOURCE_COLUMNS)} FROM {MAINTAINED_TABLE} '
+                'WHERE link_normalized IS NULL AND fingerprint IS NULL ORDER BY id'
+            ).fetchall()
+            for keys in backfill_dedup_keys(pending, taken):
+                self.conn.execute(
+                    f'UPDATE {MAINTAINED_TABLE} SET link_normalized = ?, fingerprint = ? WHERE id = ?', list(keys)
+                )
+            self.conn.execute(
+                f'CREATE INDEX IF NOT EXISTS {MAINTAINED_TABLE}_link_normalized_idx ON {MAINTAINED_TABLE} (link_normalized)'
+            )
+            self.conn.execute(
+                f'CREATE INDEX IF NOT EXISTS {MAINTAINED_TABLE}_fingerprint_idx ON {MAINTAINED_TABLE} (fingerprint)'
+            )
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {OUTBOX_TABLE} (
+                    id BIGINT PRIMARY KEY,
+                    op VARCHAR,
+                    tbl VARCHAR,
+                    payload VARCHAR,
+                    created_at TIMESTAMP,
+                    attempts INTEGER DEFAULT 0,
+                    last_error VARCHAR
+                )
+            """)
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {DEAD_LETTER_TABLE} (
+                    id BIGINT PRIMARY KEY,
+                    op VARCHAR,
+                    tbl VARCHAR,
+                    payload VARCHAR,
+                    created_at TIMESTAMP,
+                    attempts INTEGER,
+                    failed_at TIMESTAMP,
+                    error VARCHAR
+                )
+            """)
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {ID_MAP_TABLE} (
+                    tbl VARCHAR,
+                    local_id BIGINT,
+                    remote_id BIGINT,
+                    PRIMARY KEY (tbl, local_id)
+                )
+            """)
+            self.refresh_aggregates()
+        if self.remote is not None:
+            self.start_sync()
+
+    # Reads
+
+    def load_data(self):
+        with self.lock:
+            return self.conn.execute(f'SELECT * FROM {TABLE_NAME}').df()
+
+    def load_maintained(self):
+        with self.lock:
+            return normalize_maintained(self.conn.execute(f'SELECT * FROM {MAINTAINED_TABLE}').df())
+
+    def find_duplicate(self, link_normalized=None, fingerprint=None, exclude_id=None):
+        """The existing interested item with this normalized link or fingerprint, if any."""
+        with self.lock:
+            for column, value in [('link_normalized', link_normalized), ('fingerprint', fingerprint)]:
+                if value is not None:
+                    row = first_row(self.conn.execute(
+                        f'SELECT * FROM {MAINTAINED_TABLE} WHERE {column} = ? AND id IS DISTINCT FROM ? ORDER BY id LIMIT 1',
+                        [value, exclude_id]
+                    ).df())
+                    if row is not None:
+                        return row
+            return None
+
+    def load_aggregate(self, name):
+        check_aggregate(name)
+        with self.lock:
+            if self.aggregates_stale:
+                self.refresh_aggregates()
+                self.aggregates_stale = False
+            return self.conn.execute(f'SELECT * FROM {name}').df()
+
+    def query(self, sql, params=None):
+        """Run an arbitrary read-only query against the local copy."""
+        with self.lock:
+            return self.conn.execute(sql, params or []).df()
+
+    # Writes (local table + outbox entry in one transaction)
+
+    def save_data(self, df):
+        rows = [dict(zip(DATA_COLUMNS, row_values(row, DATA_COLUMNS))) for _, row in df.iterrows()]
+        with self.transaction():
+            self.conn.execute(f'DELETE FROM {TABLE_NAME}')
+            for row in rows:
+                row['id'] = self.next_local_id()
+                self.insert_local(TABLE_NAME, ['id'] + DATA_COLUMNS, row)
+            self.enqueue('replace', TABLE_NAME, {'rows': rows})
+            self.aggregates_stale = True
+
+    def save_maintained(self, df):
+        rows = [dict(zip(MAINTAINED_COLUMNS, maintained_values(row))) for _, row in df.iterrows()]
+        rows = drop_duplicate_links(rows)
+        with self.transaction():
+            self.conn.execute(f'DELETE FROM {MAINTAINED_TABLE}')
+            for row in rows:
+                row['id'] = self.next_local_id()
+                self.insert_local(MAINTAINED_TABLE, ['id'] + MAINTAINED_COLUMNS, row)
+            self.enqueue('replace', MAINTAINED_TABLE, {'rows': rows})
+            self.aggregates_stale = True
+
+    def insert_maintained(self, row):
+        row = dict(zip(MAINTAINED_COLUMNS, maintained_values(row)))
+        with self.transaction():
+            # Postgres enforces this with a unique index; check here so the outbox never holds a doomed insert
+            self.check_link_unique(row['link_normalized'])
+            row['id'] = self.next_local_id()
+            self.insert_local(MAINTAINED_TABLE, ['id'] + MAINTAINED_COLUMNS, row)
+            self.enqueue('insert', MAINTAINED_TABLE, {'row': row})
+            self.aggregates_stale = True
+        return row['id']
+
+    def update_maintained_row(self, row_id, updates):
+        updates = filter_updates(updates)
+        with self.transaction():
+            row_id = self.resolve_id(MAINTAINED_TABLE, int(row_id))
+            current = self.conn.execute(
+                f'SELECT {quote_columns(DEDUP_SOURCE_COLUMNS)} FROM {MAINTAINED_TABLE} WHERE id = ?', [row_id]
+            ).fetchone()
+            if current is None:
+                raise ValueError(f"Interested item {row_id} no longer exists")
+            keys = changed_dedup_keys(dict(zip(DEDUP_SOURCE_COLUMNS, current)), updates)
+            self.check_link_unique(keys.get('link_normalized'), exclude_id=row_id)
+            set_clauses = [f'"{key}" = ?' for key in {**updates, **keys}] + ['updated_at = ?']
+            self.conn.execute(
+                f"UPDATE {MAINTAINED_TABLE} SET {', '.join(set_clauses)} WHERE id = ?",
+                list(updates.values()) + list(keys.values()) + [datetime.now(), row_id]
+            )
+            self.enqueue('update', MAINTAINED_TABLE, {'id': row_id, 'updates': updates})
+            self.aggregates_stale = True
+
+    def resolve_id(self, table, row_id):
+        """The current id of a row, following the id map if it was created locally and has synced since."""
+        if row_id >= 0:
+            return row_id
+        mapped = self.conn.execute(
+            f'SELECT remote_id FROM {ID_MAP_TABLE} WHERE tbl = ? AND local_id = ?', [table, row_id]
+        ).fetchone()
+        return row_id if mapped is None else mapped[0]
+
+    def check_link_unique(self, link_normalized, exclude_id=None):
+        if link_normalized is None:
+            return
+        duplicate = self.find_duplicate(link_normalized=link_normalized, exclude_id=exclude_id)
+        if duplicate is not None:
+            raise ValueError(f"Interested item {duplicate['id']} already has this link")
+
+    def refresh_aggregates(self):
+        for statement in refresh_statements('duckdb', TABLE_NAME, MAINTAINED_TABLE):
+            self.conn.execute(statement)
+
+    def transaction(self):
+        return _DuckDBTransaction(self)
+
+    def next_local_id(self):
+        return -self.conn.execute("SELECT nextval('local_id_seq')").fetchone()[0]
+
+    def insert_local(self, table, columns, row):
+        placeholders = ', '.join(['?'] * len(columns))
+        self.conn.execute(
+            f'INSERT INTO {table} ({quote_columns(columns)}) VALUES ({placeholders})',
+            [row.get(col) for col in columns]
+        )
+
+    def enqueue(self, op, table, payload):
+        self.conn.execute(
+            f"INSERT INTO {OUTBOX_TABLE} (id, op, tbl, payload, created_at) "
+            "VALUES (nextval('outbox_id_seq'), ?, ?, ?, ?)",
+            [op, table, json.dumps(payload, default=str), datetime.now()]
+        )
+
+    # Sync
+
+    def pending(self):
+        with self.lock:
+            return self.conn.execute(f'SELECT COUNT(*) FROM {OUTBOX_TABLE}').fetchone()[0]
+
+    def dead_letters(self):
+        with self.lock:
+            return self.conn.execute(f'SELECT * FROM {DEAD_LETTER_TABLE} ORDER BY id').df()
+
+    def status(self):
+        with self.lock:
+            attempts, dead = self.conn.execute(
+                f'SELECT (SELECT MAX(attempts) FROM {OUTBOX_TABLE}), (SELECT COUNT(*) FROM {DEAD_LETTER_TABLE})'
+            ).fetchone()
+        return {
+            'backend': 'duckdb' if self.remote is not None else 'duckdb (offline)',
+            'pending': self.pending(),
+            'attempts': attempts or 0,  # failed tries of the oldest stuck entry
+            'dead_letters': dead,
+            'last_sync': self.last_sync,
+            'last_error': self.last_error,
+        }
+
+    def start_sync(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.sync_loop, name='outbox-sync', daemon=True)
+        self.thread.start()
+
+    def stop_sync(self):
+        self.stopped.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def sync_loop(self):
+        backoff = self.sync_interval
+        remote_ready = False
+        while not self.stopped.is_set():
+            try:
+                if not remote_ready:
+                    # Create the remote tables, dedup columns and views before replaying anything into them
+                    self.remote.init()
+                    remote_ready = True
+                self.sync_once()
+                if time.time() - self.last_refresh >= self.refresh_interval:
+                    self.refresh()
+                self.last_error = None
+                backoff = self.sync_interval
+            except Exception as e:
+                self.last_error = str(e)
+                backoff = min(backoff * 2, 60.0)
+            self.wake.wait(backoff)
+            self.wake.clear()
+
+    def sync_once(self):
+        """Replay outbox entries against Postgres, oldest first, until it is empty."""
+        while not self.stopped.is_set():
+            with self.lock:
+                entry = self.conn.execute(
+                    f'SELECT id, op, tbl, payload FROM {OUTBOX_TABLE} ORDER BY id LIMIT 1'
+                ).fetchone()
+            if entry is None:
+                return
+            entry_id, op, table, payload = entry
+            try:
+                remapped, dropped = self.replay(op, table, json.loads(payload))
+            except PERMANENT_SYNC_ERRORS as e:
+                self.set_aside(entry_id, e)
+                continue
+            except Exception as e:
+                with self.lock:
+                    self.conn.execute(
+                        f'UPDATE {OUTBOX_TABLE} SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                        [str(e), entry_id]
+                    )
+                raise
+            if dropped:
+                # Part of the entry was synced; keep the rest on record instead
+                self.set_aside(entry_id, dropped[1], dropped[0])
+            with self.transaction():
+                self.conn.execute(f'DELETE FROM {OUTBOX_TABLE} WHERE id = ?', [entry_id])
+                for local_id, remote_id in remapped.items():
+                    self.remap_id(table, local_id, remote_id)
+            self.last_sync = datetime.now()
+
+    def set_aside(self, entry_id, error, payload=None):
+        """Move an outbox entry (or just payload, the part of it that was not synced) to the dead-letter table."""
+        with self.transaction():
+            self.conn.execute(
+                f'INSERT INTO {DEAD_LETTER_TABLE} (id, op, tbl, payload, created_at, attempts, failed_at, error) '
+                f'SELECT id, op, tbl, COALESCE(?, payload), created_at, attempts + 1, ?, ? FROM {OUTBOX_TABLE} WHERE id = ?',
+                [None if payload is None else json.dumps(payload, default=str), datetime.now(), str(error), entry_id]
+            )
+            self.conn.execute(f'DELETE FROM {OUTBOX_TABLE} WHERE id = ?', [entry_id])
+
+    def replay(self, op, table, payload):
+        """
+        Apply one outbox entry to Postgres. Returns {local id: remote id} for new
+        rows, and (payload, reason) for the part of the entry that was dropped
+        (or None).
+        """
+        remapped = {}
+        dropped = None
+        conn = self.remote.connect()
+        try:
+            cursor = conn.cursor()
+            if op == 'insert':
+                try:
+                    remapped[payload['row']['id']] = pg_insert_maintained(cursor, payload['row'])
+                except psycopg2.errors.UniqueViolation:
+                    # Someone else added the same listing meanwhile; merge into their row instead
+                    conn.rollback()
+                    remapped[payload['row']['id']] = pg_merge_maintained(cursor, payload['row'])
+            elif op == 'update':
+                if payload['id'] < 0:
+                    raise ValueError(f"Interested item {payload['id']} was never synced")
+                try:
+                    pg_update_maintained(cursor, payload['id'], payload['updates'])
+                except psycopg2.errors.UniqueViolation:
+                    if 'link' not in payload['updates']:
+                        raise
+                    # The new link belongs to another item by now; sync the other changes without it
+                    conn.rollback()
+                    updates = {key: val for key, val in payload['updates'].items() if key != 'link'}
+                    if updates:
+                        pg_update_maintained(cursor, payload['id'], updates)
+                    dropped = (
+                        {'id': payload['id'], 'updates': {'link': payload['updates']['link']}},
+                        'Link change not synced: another interested item already has this link'
+                        + ('; the other changes were synced' if updates else ''),
+                    )
+            elif op == 'replace' and table == TABLE_NAME:
+                pg_replace_data(cursor, pd.DataFrame(payload['rows'], columns=DATA_COLUMNS))
+            elif op == 'replace':
+                cursor.execute(f"DELETE FROM {MAINTAINED_TABLE}")
+                for row in payload['rows']:
+                    remapped[row['id']] = pg_insert_maintained(cursor, row)
+            else:
+                raise ValueError(f"Unknown outbox operation: {op} on {table}")
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        self.remote.schedule_aggregate_refresh()
+        return remapped, dropped
+
+    def remap_id(self, table, local_id, remote_id):
+        if self.conn.execute(f'SELECT 1 FROM {table} WHERE id = ?', [remote_id]).fetchone():
+            # Merged into a row we already have; the next refresh pulls the merged version
+            self.conn.execute(f'DELETE FROM {table} WHERE id = ?', [local_id])
+        else:
+            self.conn.execute(f'UPDATE {table} SET id = ? WHERE id = ?', [remote_id, local_id])
+        self.conn.execute(
+            f'INSERT OR REPLACE INTO {ID_MAP_TABLE} (tbl, local_id, remote_id) VALUES (?, ?, ?)',
+            [table, local_id, remote_id]
+        )
+        pending = self.conn.execute(
+            f"SELECT id, payload FROM {OUTBOX_TABLE} WHERE tbl = ? AND op = 'update'", [table]
+        ).fetchall()
+        for entry_id, payload in pending:
+            payload = json.loads(payload)
+            if payload['id'] == local_id:
+                payload['id'] = remote_id
+                self.conn.execute(
+                    f'UPDATE {OUTBOX_TABLE} SET payload = ? WHERE id = ?',
+                    [json.dumps(payload, default=str), entry_id]
+                )
+
+    def refresh(self):
+        """Pull the remote tables into the local copy, unless local writes are still pending."""
+        if self.pending():
+            return False
+        version = self.version
+        data_df = self.remote.load_data()
+        # Not remote.load_maintained(): its astype(str) for the UI would store NULLs as 'None'
+        conn = self.remote.connect()
+        try:
+            maintained_df = pg_load_maintained(conn)
+        finally:
+            conn.close()
+        with self.transaction():
+            # A write slipped in while we were fetching; try again next round
+            if self.version != version or self.conn.execute(f'SELECT COUNT(*) FROM {OUTBOX_TABLE}').fetchone()[0]:
+                return False
+            self.replace_local(TABLE_NAME, data_df)
+            self.replace_local(MAINTAINED_TABLE, maintained_df)
+            self.aggregates_stale = True
+        self.last_refresh = time.time()
+        return True
+
+    def replace_local(self, table, df):
+        local_columns = [row[0] for row in self.conn.execute(f'DESCRIBE {table}').fetchall()]
+        columns = [col for col in local_columns if col in df.columns]
+        self.conn.execute(f'DELETE FROM {table}')
+        if df.empty:
+            return
+        self.conn.register('remote_df', df[columns])
+        try:
+            self.conn.execute(
+                f'INSERT INTO {table} ({quote_columns(columns)}) SELECT {quote_columns(columns)} FROM remote_df'
+            )
+        finally:
+            self.conn.unregister('remote_df')
+
+    def close(self):
+        self.stop_sync()
+        with self.lock:
+            self.conn.close()
+
+
+class _DuckDBTransaction:
+    """Hold the backend lock and wrap the block in a DuckDB transaction."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __enter__(self):
+        self.backend.lock.acquire()
+        self.backend.conn.execute('BEGIN TRANSACTION')
+        return self.backend.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.backend.conn.execute('COMMIT')
+                self.backend.version += 1
+            else:
+                self.backend.conn.execute('ROLLBACK')
+        finally:
+            self.backend.lock.release()
+        if exc_type is None:
+            self.backend.wake.set()
+        return False
+
+
+def get_backend(database_url):
+    """
+    Pick the storage backend from the environment:
+      STORAGE_BACKEND=postgres (default) or duckdb
+      DUCKDB_FILE=path to the local database (duckdb only)
+      OFFLINE=1 to keep writes in the local outbox without syncing (duckdb only)
+    """
+    kind = os.getenv('STORAGE_BACKEND', 'postgres').lower()
+    if kind == 'duckdb':
+        offline = os.getenv('OFFLINE', '').lower() in ('1', 'true', 'yes')
+        return DuckDBBackend(os.getenv('DUCKDB_FILE', DUCKDB_FILE), sync_url=None if offline else database_url)
+    if kind != 'postgres':
+        raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+    return PostgresBackend(database_url)
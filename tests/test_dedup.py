@@ -0,0 +1,86 @@
+"""
+Tests for duplicate-listing detection: link normalization, content
+fingerprints and the updates that fold a re-added listing into an existing row.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedup import normalize_link, content_fingerprint, dedup_keys, merge_updates  # noqa: E402
+
+
+@pytest.mark.parametrize('link, expected', [
+    ('https://www.homegate.ch/kaufen/123', 'https://homegate.ch/kaufen/123'),
+    ('http://m.homegate.ch/kaufen/123/', 'https://homegate.ch/kaufen/123'),
+    ('homegate.ch/kaufen/123', 'https://homegate.ch/kaufen/123'),
+    ('https://HOMEGATE.ch//kaufen///123#photos', 'https://homegate.ch/kaufen/123'),
+    ('https://homegate.ch/kaufen/123?utm_source=mail&utm_campaign=x&gclid=abc', 'https://homegate.ch/kaufen/123'),
+    ('https://homegate.ch/search?rooms=4&canton=ZH&ref=nav', 'https://homegate.ch/search?canton=ZH&rooms=4'),
+    ('https://homegate.ch:443/kaufen/123', 'https://homegate.ch/kaufen/123'),
+    ('https://homegate.ch:8080/kaufen/123', 'https://homegate.ch:8080/kaufen/123'),
+    ('https://www.amp.homegate.ch/a', 'https://homegate.ch/a'),
+])
+def test_normalize_link(link, expected):
+    assert normalize_link(link) == expected
+
+
+@pytest.mark.parametrize('link, expected', [
+    ('https://mobile.de/x', 'https://mobile.de/x'),
+    ('https://m.ch/a', 'https://m.ch/a'),
+    ('https://www.m.ch/a', 'https://m.ch/a'),
+])
+def test_normalize_link_keeps_short_domains(link, expected):
+    assert normalize_link(link) == expected
+
+
+@pytest.mark.parametrize('link', [None, '', '  ', 'None', 'nan', float('nan')])
+def test_normalize_link_blank(link):
+    assert normalize_link(link) is None
+
+
+def listing(**fields):
+    return {'Gemeinde': 'Uster', 'Buy Price': "1'250'000", 'Living Space': '120', 'Rooms': '4.5', **fields}
+
+
+def test_fingerprint_ignores_number_formatting_and_case():
+    assert content_fingerprint(listing()) == content_fingerprint(
+        listing(**{'Gemeinde': ' uster ', 'Buy Price': '1250000', 'Living Space': '120.0', 'Rooms': "4.50"})
+    )
+
+
+def test_fingerprint_differs_for_other_listings():
+    assert content_fingerprint(listing()) != content_fingerprint(listing(Rooms='5.5'))
+    assert content_fingerprint(listing()) != content_fingerprint(listing(Gemeinde='Wetzikon'))
+
+
+@pytest.mark.parametrize('missing', ['Buy Price', 'Living Space'])
+def test_fingerprint_needs_price_and_living_space(missing):
+    assert content_fingerprint(listing(**{missing: None})) is None
+    assert content_fingerprint(listing(**{missing: 'nan'})) is None
+
+
+def test_dedup_keys():
+    keys = dedup_keys(listing(link='https://www.homegate.ch/kaufen/1/'))
+    assert keys == {'link_normalized': 'https://homegate.ch/kaufen/1', 'fingerprint': content_fingerprint(listing())}
+
+
+def test_merge_fills_only_blank_fields():
+    existing = {'Buy Price': '900000', 'Rooms': None, 'Living Space': 'nan', 'link': '', 'status': 'interested'}
+    new_row = {'Buy Price': '950000', 'Rooms': '4.5', 'Living Space': '110', 'link': 'https://example.ch/1', 'status': 'interested'}
+    assert merge_updates(existing, new_row) == {'Rooms': '4.5', 'Living Space': '110', 'link': 'https://example.ch/1'}
+
+
+def test_merge_appends_new_notes_once():
+    existing = {'notes': 'south facing'}
+    assert merge_updates(existing, {'notes': 'viewing on Monday'}) == {'notes': 'south facing\nviewing on Monday'}
+    assert merge_updates(existing, {'notes': 'south facing'}) == {}
+    assert merge_updates({'notes': None}, {'notes': ' call agent '}) == {'notes': 'call agent'}
+
+
+def test_merge_restores_a_deleted_row():
+    assert merge_updates({'status': 'delete'}, {'status': 'interested'}) == {'status': 'interested'}
+    assert merge_updates({'status': 'contacted'}, {'status': 'interested'}) == {}
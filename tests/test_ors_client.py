@@ -0,0 +1,154 @@
+"""
+Offline tests for the shared OpenRouteService client.
+
+FakeSession stands in for requests.Session: it replays canned responses and
+can hold a request open so concurrent callers pile up behind it.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ors_client import ENDPOINT_LIMITS, ORSClient, QuotaExceeded, TokenBucket  # noqa: E402
+
+GEOCODE_OK = {'features': [{'geometry': {'coordinates': [8.72, 47.35]}}]}
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data if data is not None else GEOCODE_OK
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} error', response=self)
+
+
+class FakeSession:
+    """Returns the queued responses in order (the last one repeats)."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses) or [FakeResponse()]
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        self.release.wait()
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+    post = get
+
+
+def client(*responses, **kwargs):
+    return ORSClient('test-key', backoff=0.0, session=FakeSession(*responses), **kwargs)
+
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(2, per=1.0)
+    assert bucket.acquire(timeout=0)
+    assert bucket.acquire(timeout=0)
+
+    started = time.monotonic()
+    assert bucket.acquire(timeout=0.1) is False
+    assert time.monotonic() - started < 0.05  # gives up without sleeping
+
+    assert bucket.acquire(timeout=1.0)
+    assert time.monotonic() - started >= 0.4
+
+
+def test_identical_concurrent_calls_share_one_request():
+    ors = client()
+    ors.session.release.clear()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(ors.geocode('Uster'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 2.0
+    while ors.stats()['geocode']['coalesced'] < 4:
+        assert time.monotonic() < deadline, 'callers did not join the request in flight'
+        time.sleep(0.01)
+    ors.session.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert ors.session.calls == 1
+    assert results == [(47.35, 8.72)] * 5
+    assert ors.stats()['geocode']['calls'] == 1
+
+
+def test_joined_call_times_out():
+    ors = client()
+    ors.flight_timeout = 0.05
+    ors.session.release.clear()
+    leader = threading.Thread(target=ors.geocode, args=('Uster',))
+    leader.start()
+    while ors.session.calls == 0:
+        time.sleep(0.01)
+
+    with pytest.raises(TimeoutError):
+        ors.geocode('Uster')
+    ors.session.release.set()
+    leader.join()
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_retries_on_rate_limit_and_server_errors(status):
+    ors = client(FakeResponse(status), FakeResponse(status), FakeResponse())
+    assert ors.geocode('Uster') == (47.35, 8.72)
+    assert ors.session.calls == 3
+    assert ors.stats()['geocode']['retries'] == 2
+    assert ors.stats()['geocode']['errors'] == 2
+
+
+def test_gives_up_after_max_retries():
+    ors = client(FakeResponse(502), max_retries=2)
+    with pytest.raises(requests.HTTPError):
+        ors.geocode('Uster')
+    assert ors.session.calls == 3
+
+
+@pytest.mark.parametrize('status', [400, 401, 404])
+def test_client_errors_are_not_retried(status):
+    ors = client(FakeResponse(status))
+    with pytest.raises(requests.HTTPError):
+        ors.geocode('Uster')
+    assert ors.session.calls == 1
+    assert ors.stats()['geocode']['retries'] == 0
+
+
+def test_long_retry_after_raises_without_waiting():
+    ors = client(FakeResponse(429, headers={'Retry-After': '3600'}), wait_timeout=1.0)
+    started = time.monotonic()
+    with pytest.raises(requests.HTTPError):
+        ors.geocode('Uster')
+    assert time.monotonic() - started < 0.5
+    assert ors.session.calls == 1
+
+
+def test_daily_quota_is_enforced():
+    ors = client()
+    ors.used_today['geocode'] = ENDPOINT_LIMITS['geocode'][1]
+    with pytest.raises(QuotaExceeded):
+        ors.geocode('Uster')
+    assert ors.session.calls == 0
+
+
+def test_quota_reported_by_ors_is_enforced():
+    ors = client(FakeResponse(headers={'x-ratelimit-remaining': '0'}))
+    ors.geocode('Uster')
+    assert ors.stats()['geocode']['remaining'] == 0
+    with pytest.raises(QuotaExceeded):
+        ors.geocode('Wetzikon')
+    assert ors.session.calls == 1
@@ -0,0 +1,107 @@
+"""
+Offline tests for snapshot export/import.
+
+FakeConnection serves canned rows to export_table() and records the CSV that
+import_table() would send to COPY, so no database is needed.
+"""
+
+import os
+import sys
+from datetime import datetime, timezone
+
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot  # noqa: E402
+
+COLUMNS = [('id', 'integer'), ('notes', 'text'), ('added_at', 'timestamp without time zone'),
+           ('updated_at', 'timestamp with time zone'), ('extra', 'jsonb')]
+
+
+class FakeCursor:
+    def __init__(self, columns=(), rows=()):
+        self.columns = list(columns)
+        self.rows = list(rows)
+        self.itersize = None
+        self.statements = []
+        self.copied = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(statement)
+
+    def fetchall(self):
+        return self.columns
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def copy_expert(self, statement, file):
+        self.copied.append(file.read().decode('utf-8'))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def cursor(self, name=None):
+        return FakeCursor(self.columns, self.rows if name else ())
+
+
+def export(tmp_path, rows, chunk_rows=3, columns=COLUMNS):
+    return snapshot.export_table(FakeConnection(columns, rows), 'interested_items1', str(tmp_path), chunk_rows)
+
+
+def parts(tmp_path):
+    return sorted(os.listdir(tmp_path / 'interested_items1'))
+
+
+@pytest.mark.parametrize('row_count, expected_parts', [(0, 1), (3, 1), (4, 2), (7, 3)])
+def test_export_chunks(tmp_path, row_count, expected_parts):
+    rows = [(i, f'note {i}', None, None, None) for i in range(row_count)]
+    entry = export(tmp_path, rows)
+
+    assert entry['rows'] == row_count
+    assert entry['parts'] == expected_parts
+    assert len(parts(tmp_path)) == expected_parts
+    restored = pq.read_table(tmp_path / 'interested_items1')
+    assert restored.num_rows == row_count
+    assert restored.column_names == [name for name, _ in COLUMNS]
+
+
+def test_missing_table_is_skipped(tmp_path):
+    assert export(tmp_path, [], columns=[]) is None
+
+
+def test_round_trip_csv_keeps_nulls_empty_strings_and_timestamps(tmp_path):
+    rows = [
+        (1, None, datetime(2024, 6, 1, 12, 30, 0, 250000), datetime(2024, 6, 1, 10, 0, tzinfo=timezone.utc), '{"a": 1}'),
+        (2, '', None, None, None),
+        (3, 'says "hi", twice', None, None, ''),
+    ]
+    entry = export(tmp_path, rows)
+    cursor = FakeCursor()
+
+    assert snapshot.import_table(cursor, 'interested_items1', entry, str(tmp_path)) == 3
+
+    assert ''.join(cursor.copied).splitlines() == [
+        '"id","notes","added_at","updated_at","extra"',
+        '1,,2024-06-01 12:30:00.250000,2024-06-01 10:00:00.000000Z,"{""a"": 1}"',  # unquoted empty = NULL
+        '2,"",,,',  # quoted empty = empty string
+        '3,"says ""hi"", twice",,,""',
+    ]
+
+
+def test_import_copies_every_part(tmp_path):
+    entry = export(tmp_path, [(i, str(i), None, None, None) for i in range(7)], chunk_rows=3)
+    cursor = FakeCursor()
+
+    assert snapshot.import_table(cursor, 'interested_items1', entry, str(tmp_path), batch_rows=2) == 7
+    data_lines = [line for csv in cursor.copied for line in csv.splitlines()[1:]]
+    assert [line.split(',')[0] for line in data_lines] == [str(i) for i in range(7)]
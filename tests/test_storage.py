@@ -0,0 +1,364 @@
+"""
+Offline tests for the DuckDB backend's outbox sync.
+
+Postgres is replaced by FakeRemote: the pg_* helpers that replay() calls are
+patched to read and write a dict, and failures can be injected per call.
+"""
+
+import os
+import sys
+import json
+import time
+
+import pandas as pd
+import psycopg2
+import psycopg2.errors
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+from storage import MAINTAINED_COLUMNS, MAINTAINED_TABLE  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self, log=None):
+        self.log = log if log is not None else []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.log.append(sql)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeRemote:
+    """Stands in for PostgresBackend; interested items live in self.rows keyed by id."""
+
+    def __init__(self):
+        self.rows = {}
+        self.next_id = 100
+        self.down = False
+        self.aggregate_refreshes = 0
+        self.inits = 0
+
+    def connect(self):
+        if self.down:
+            raise psycopg2.OperationalError('connection refused')
+        return FakeConnection()
+
+    def init(self):
+        self.connect()
+        self.inits += 1
+
+    def load_data(self):
+        return pd.DataFrame(columns=['id'] + storage.DATA_COLUMNS)
+
+    def load(self, conn):
+        return pd.DataFrame([{'id': row_id, **row} for row_id, row in self.rows.items()])
+
+    def load_maintained(self):
+        return storage.normalize_maintained(self.load(self.connect()))
+
+    def schedule_aggregate_refresh(self):
+        self.aggregate_refreshes += 1
+
+    def check_link(self, link_normalized, row_id=None):
+        for other_id, other in self.rows.items():
+            if link_normalized is not None and other['link_normalized'] == link_normalized and other_id != row_id:
+                raise psycopg2.errors.UniqueViolation('duplicate key value violates unique constraint')
+
+    def insert(self, cursor, row):
+        row = dict(zip(MAINTAINED_COLUMNS, storage.maintained_values(row)))
+        self.check_link(row['link_normalized'])
+        self.next_id += 1
+        self.rows[self.next_id] = row
+        return self.next_id
+
+    def update(self, cursor, row_id, updates):
+        if row_id not in self.rows:
+            raise ValueError(f"Interested item {row_id} no longer exists")
+        updates = storage.filter_updates(updates)
+        merged = {**self.rows[row_id], **updates}
+        merged.update(storage.changed_dedup_keys(self.rows[row_id], updates))
+        self.check_link(merged['link_normalized'], row_id)
+        self.rows[row_id] = merged
+
+    def merge(self, cursor, row):
+        link_normalized = storage.normalize_link(row.get('link'))
+        row_id = next(i for i, other in self.rows.items() if other['link_normalized'] == link_normalized)
+        updates = storage.merge_updates(self.rows[row_id], row)
+        if updates:
+            self.update(cursor, row_id, updates)
+        return row_id
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    fake = FakeRemote()
+    monkeypatch.setattr(storage, 'pg_insert_maintained', fake.insert)
+    monkeypatch.setattr(storage, 'pg_update_maintained', fake.update)
+    monkeypatch.setattr(storage, 'pg_merge_maintained', fake.merge)
+    monkeypatch.setattr(storage, 'pg_load_maintained', fake.load)
+    return fake
+
+
+@pytest.fixture
+def backend(remote):
+    # No sync_url, so no background thread: tests drive sync_once() themselves
+    db = storage.DuckDBBackend(':memory:')
+    db.init()
+    db.remote = remote
+    yield db
+    db.close()
+
+
+def add(backend, link, **fields):
+    return backend.insert_maintained({'Canton': 'ZH', 'Gemeinde': 'Uster', 'link': link, 'status': 'interested', **fields})
+
+
+def local_row(backend, row_id):
+    return backend.query(f'SELECT * FROM {MAINTAINED_TABLE} WHERE id = ?', [row_id]).to_dict('records')
+
+
+def test_offline_writes_queue_in_outbox():
+    db = storage.DuckDBBackend(':memory:')
+    db.init()
+    row_id = add(db, 'https://example.ch/1')
+    db.update_maintained_row(row_id, {'notes': 'call agent'})
+
+    assert row_id < 0
+    assert db.load_maintained().loc[0, 'notes'] == 'call agent'
+    assert db.status()['pending'] == 2
+    assert db.status()['backend'] == 'duckdb (offline)'
+    db.close()
+
+
+def test_insert_is_remapped_and_pending_update_follows(backend, remote):
+    row_id = add(backend, 'https://example.ch/1')
+    backend.update_maintained_row(row_id, {'status': 'contacted'})
+
+    backend.sync_once()
+
+    assert backend.pending() == 0
+    assert list(remote.rows) == [101]
+    assert remote.rows[101]['status'] == 'contacted'
+    assert local_row(backend, 101)[0]['status'] == 'contacted'
+    assert local_row(backend, row_id) == []
+
+
+def test_stale_local_id_edits_synced_row(backend, remote):
+    row_id = add(backend, 'https://example.ch/1')
+    backend.sync_once()
+
+    # The page still holds the id from before the sync
+    backend.update_maintained_row(row_id, {'status': 'visited'})
+    backend.sync_once()
+
+    assert local_row(backend, 101)[0]['status'] == 'visited'
+    assert remote.rows[101]['status'] == 'visited'
+
+
+def test_update_of_missing_row_raises(backend):
+    with pytest.raises(ValueError):
+        backend.update_maintained_row(-42, {'status': 'visited'})
+    assert backend.pending() == 0
+
+
+def test_legacy_duplicate_link_stays_editable():
+    db = storage.DuckDBBackend(':memory:')
+    db.init()
+    for row_id, link in [(1, 'https://www.homegate.ch/kaufen/1'), (2, 'https://homegate.ch/kaufen/1?utm_source=x')]:
+        db.conn.execute(f'INSERT INTO {MAINTAINED_TABLE} (id, link, status) VALUES (?, ?, ?)', [row_id, link, 'interested'])
+    db.init()  # backfills the dedup keys; the second link is left NULL
+
+    db.update_maintained_row(2, {'status': 'delete'})
+    assert local_row(db, 2)[0]['status'] == 'delete'
+    assert local_row(db, 2)[0]['link_normalized'] is None
+
+    with pytest.raises(ValueError):
+        db.update_maintained_row(2, {'link': 'https://homegate.ch/kaufen/1'})
+    db.update_maintained_row(2, {'link': 'https://homegate.ch/kaufen/2'})
+    assert local_row(db, 2)[0]['link_normalized'] == 'https://homegate.ch/kaufen/2'
+    db.close()
+
+
+def test_connection_failure_keeps_entry_for_retry(backend, remote):
+    add(backend, 'https://example.ch/1')
+    remote.down = True
+
+    with pytest.raises(psycopg2.OperationalError):
+        backend.sync_once()
+    with pytest.raises(psycopg2.OperationalError):
+        backend.sync_once()
+    assert backend.pending() == 1
+    assert backend.status()['attempts'] == 2
+
+    remote.down = False
+    backend.sync_once()
+    assert backend.pending() == 0
+    assert backend.status()['dead_letters'] == 0
+    assert len(remote.rows) == 1
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_sync_thread_creates_remote_schema_before_replaying(backend, remote):
+    add(backend, 'https://example.ch/1')
+    remote.down = True
+    backend.sync_interval = 0.01
+    backend.start_sync()
+
+    wait_for(lambda: backend.status()['last_error'] == 'connection refused')
+    assert remote.inits == 0
+    assert backend.pending() == 1
+    assert backend.status()['dead_letters'] == 0
+
+    remote.down = False
+    wait_for(lambda: backend.pending() == 0)
+    assert remote.inits == 1
+    assert len(remote.rows) == 1
+
+
+def test_rejected_entry_is_set_aside_and_queue_continues(backend, remote):
+    row_id = add(backend, 'https://example.ch/1')
+    backend.sync_once()
+    del remote.rows[101]  # deleted by another session
+    backend.update_maintained_row(row_id, {'status': 'visited'})
+    add(backend, 'https://example.ch/2')
+
+    backend.sync_once()
+
+    assert backend.pending() == 0
+    dead = backend.dead_letters()
+    assert list(dead['op']) == ['update']
+    assert 'no longer exists' in dead.loc[0, 'error']
+    assert [row['link'] for row in remote.rows.values()] == ['https://example.ch/2']
+
+
+def test_conflicting_link_change_is_set_aside_and_rest_synced(backend, remote):
+    add(backend, 'https://example.ch/1')
+    row_id = add(backend, 'https://example.ch/2')
+    backend.sync_once()
+    # Another session moves item 101 to the link this session is about to use
+    remote.rows[101].update(link='https://example.ch/3', link_normalized='https://example.ch/3')
+    backend.update_maintained_row(row_id, {'link': 'https://example.ch/3', 'notes': 'call agent'})
+
+    backend.sync_once()
+
+    assert backend.pending() == 0
+    assert remote.rows[102]['notes'] == 'call agent'
+    assert remote.rows[102]['link'] == 'https://example.ch/2'
+    dead = backend.dead_letters()
+    assert list(dead['op']) == ['update']
+    assert json.loads(dead.loc[0, 'payload']) == {'id': 102, 'updates': {'link': 'https://example.ch/3'}}
+    assert 'other changes were synced' in dead.loc[0, 'error']
+
+
+def test_merged_insert_drops_local_row_when_target_is_already_local(backend, remote):
+    add(backend, 'https://example.ch/1')
+    backend.sync_once()
+    backend.refresh()
+    # Another session changes the link of 101 to the one this session adds next
+    remote.rows[101].update(link='https://example.ch/2', link_normalized='https://example.ch/2')
+    row_id = add(backend, 'https://example.ch/2', notes='viewing on Monday')
+    backend.update_maintained_row(row_id, {'status': 'contacted'})
+
+    backend.sync_once()
+
+    assert list(remote.rows) == [101]
+    assert remote.rows[101]['notes'] == 'viewing on Monday'
+    assert remote.rows[101]['status'] == 'contacted'
+    assert list(backend.load_maintained()['id']) == [101]
+    assert local_row(backend, row_id) == []
+
+
+def test_refresh_waits_for_outbox_and_pulls_remote(backend, remote):
+    add(backend, 'https://example.ch/1')
+    assert backend.refresh() is False
+
+    backend.sync_once()
+    remote.rows[101]['notes'] = 'edited elsewhere'
+    assert backend.refresh() is True
+    assert local_row(backend, 101)[0]['notes'] == 'edited elsewhere'
+
+
+def test_refresh_keeps_remote_nulls(backend, remote):
+    add(backend, 'https://example.ch/1')
+    backend.sync_once()
+    assert backend.refresh() is True
+    row = local_row(backend, 101)[0]
+    assert row['Rooms'] is None
+    assert row['Buy Price'] is None
+
+
+def test_refresh_skips_when_a_write_races_the_fetch(backend, remote, monkeypatch):
+    def load_then_write(conn):
+        df = remote.load(conn)
+        add(backend, 'https://example.ch/2')  # lands while the remote copy is in flight
+        return df
+
+    monkeypatch.setattr(storage, 'pg_load_maintained', load_then_write)
+    assert backend.refresh() is False
+    assert len(backend.load_maintained()) == 1
+
+
+def test_aggregates_rebuild_on_read_after_writes(backend, remote):
+    add(backend, 'https://example.ch/1', **{'Buy Price': "1'000'000", 'Living Space': '100'})
+    add(backend, 'https://example.ch/2', **{'Buy Price': '600000', 'Living Space': '100'})
+    assert backend.aggregates_stale
+
+    canton = backend.load_aggregate('agg_canton')
+    assert not backend.aggregates_stale
+    assert canton.loc[0, 'listings'] == 2
+    assert canton.loc[0, 'median_price_per_sqm'] == 8000
+
+    backend.sync_once()
+    assert remote.aggregate_refreshes == 2
+
+
+def test_postgres_aggregate_refresh_is_debounced_and_concurrent(monkeypatch):
+    pg = storage.PostgresBackend('postgresql://unused', refresh_delay=0.05)
+    log = []
+    monkeypatch.setattr(pg, 'connect', lambda: FakeConnection(log))
+
+    for _ in range(3):
+        pg.schedule_aggregate_refresh()
+    time.sleep(0.2)
+
+    assert len(log) == len(storage.AGGREGATES)
+    assert all(sql.startswith('REFRESH MATERIALIZED VIEW CONCURRENTLY') for sql in log)
+    assert pg.status()['last_error'] is None
+
+
+def test_postgres_aggregate_refresh_waits_for_writes_to_pause(monkeypatch):
+    pg = storage.PostgresBackend('postgresql://unused', refresh_delay=0.1, refresh_max_delay=0.35)
+    refreshes = []
+    monkeypatch.setattr(pg, 'connect', lambda: FakeConnection(refreshes))
+
+    for _ in range(3):
+        pg.schedule_aggregate_refresh()
+        time.sleep(0.06)
+    assert refreshes == []  # each write pushed the refresh back
+    time.sleep(0.15)
+    assert len(refreshes) == len(storage.AGGREGATES)
+
+    refreshes.clear()
+    for _ in range(10):  # never pauses long enough, so refresh_max_delay kicks in
+        pg.schedule_aggregate_refresh()
+        time.sleep(0.06)
+    assert len(refreshes) >= len(storage.AGGREGATES)